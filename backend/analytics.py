@@ -0,0 +1,336 @@
+"""Hourly and daily order rollups for the reporting dashboards.
+
+Three collections hold one document per subject and time bucket:
+
+- ``shop_stats``: orders placed, delivered and cancelled, revenue and
+  items sold per shop
+- ``product_stats``: quantity sold and revenue per product
+- ``agent_stats``: deliveries and total delivery time per delivery agent
+
+Buckets are local times in ``REPORTING_TIMEZONE`` (default Asia/Kolkata),
+``2024-05-01T13`` for an hour and ``2024-05-01`` for a day, so a day runs
+from local midnight to midnight. Changing the timezone needs a full
+rebuild. Orders count toward the hour they were placed in; deliveries
+and cancellations count toward the hour of ``completed_at``. Delivery time
+runs from placing the order to its delivery.
+
+Order writes queue a job that recomputes the hours they touched from the
+orders themselves, then those hours' days from the hours, so a refresh
+can run any number of times. To rebuild everything, for example after
+changing a metric:
+
+    python analytics.py [--since 2024-05-01] [--mongo-url URL] [--db-name NAME]
+"""
+import argparse
+import asyncio
+import os
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache
+from pathlib import Path
+from typing import Literal, NamedTuple, Optional
+from zoneinfo import ZoneInfo
+
+from dotenv import load_dotenv
+from fastapi import HTTPException
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import UpdateOne
+
+from archive import ARCHIVE_COLLECTION, backfill_completed_at
+
+HOUR_FORMAT = "%Y-%m-%dT%H"
+DAY_FORMAT = "%Y-%m-%d"
+CREATED_AT_PREFIX = "%Y-%m-%dT%H:%M"  # created_at strings are UTC isoformat()
+MAX_BUCKETS = {"hour": 24 * 31, "day": 366}
+DEFAULT_SPAN = {"hour": timedelta(hours=48), "day": timedelta(days=30)}
+ROLLUP_DELAY_SECONDS = 30
+BATCH_SIZE = 1000
+
+
+class StatsCollection(NamedTuple):
+    name: str
+    keys: tuple
+    fields: tuple  # summed across buckets
+    labels: tuple = ()  # copied from the latest bucket
+
+
+SHOP_STATS = StatsCollection("shop_stats", ("shop_id",), ("orders", "delivered", "cancelled", "revenue", "items_sold"))
+PRODUCT_STATS = StatsCollection("product_stats", ("shop_id", "product_id"), ("quantity", "revenue"), ("product_name",))
+AGENT_STATS = StatsCollection("agent_stats", ("agent_id",), ("deliveries", "delivery_seconds"))
+
+
+class HourlySource(NamedTuple):
+    """One aggregation from orders into hourly buckets of a stats collection."""
+    stats: StatsCollection
+    scope: tuple  # (stats key, order field) a refresh is limited to
+    date_field: str
+    match: dict
+    group: dict
+    accumulators: dict
+    unwind: Optional[str] = None
+
+
+def _delivered(value) -> dict:
+    return {"$cond": [{"$eq": ["$status", "delivered"]}, value, 0]}
+
+
+SOURCES = [
+    HourlySource(
+        SHOP_STATS, ("shop_id", "shop_id"), "created_at", {},
+        {"shop_id": "$shop_id"},
+        {"orders": {"$sum": 1}},
+    ),
+    HourlySource(
+        SHOP_STATS, ("shop_id", "shop_id"), "completed_at", {"status": {"$in": ["delivered", "cancelled"]}},
+        {"shop_id": "$shop_id"},
+        {
+            "delivered": {"$sum": _delivered(1)},
+            "cancelled": {"$sum": {"$cond": [{"$eq": ["$status", "cancelled"]}, 1, 0]}},
+            "revenue": {"$sum": _delivered("$total_amount")},
+            "items_sold": {"$sum": _delivered({"$sum": "$items.quantity"})},
+        },
+    ),
+    HourlySource(
+        PRODUCT_STATS, ("shop_id", "shop_id"), "completed_at", {"status": "delivered"},
+        {"shop_id": "$shop_id", "product_id": "$items.product_id"},
+        {
+            "product_name": {"$last": "$items.product_name"},
+            "quantity": {"$sum": "$items.quantity"},
+            "revenue": {"$sum": {"$multiply": ["$items.price", "$items.quantity"]}},
+        },
+        unwind="$items",
+    ),
+    HourlySource(
+        AGENT_STATS, ("agent_id", "delivery_agent_id"), "completed_at",
+        {"status": "delivered", "delivery_agent_id": {"$ne": None}},
+        {"agent_id": "$delivery_agent_id"},
+        {
+            "deliveries": {"$sum": 1},
+            "delivery_seconds": {"$sum": {"$divide": [
+                {"$subtract": ["$completed_at", {"$dateFromString": {"dateString": "$created_at"}}]}, 1000
+            ]}},
+        },
+    ),
+]
+
+
+@lru_cache(maxsize=None)
+def reporting_timezone() -> ZoneInfo:
+    return ZoneInfo(os.environ.get('REPORTING_TIMEZONE', 'Asia/Kolkata'))
+
+
+def _local(value: datetime) -> datetime:
+    # Times without an offset are taken as UTC, as MongoDB returns them
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.astimezone(reporting_timezone())
+
+
+def hour_bucket(value) -> str:
+    """The hour bucket of a ``created_at`` ISO string or a ``completed_at`` datetime."""
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    return _local(value).strftime(HOUR_FORMAT)
+
+
+def _hour_range(source: HourlySource, hour: str) -> dict:
+    local = datetime.strptime(hour, HOUR_FORMAT).replace(tzinfo=reporting_timezone())
+    start = local.astimezone(timezone.utc)
+    end = start + timedelta(hours=1)
+    if source.date_field == "created_at":
+        # UTC ISO strings sort like the times they spell
+        return {"$gte": start.strftime(CREATED_AT_PREFIX), "$lt": end.strftime(CREATED_AT_PREFIX)}
+    return {"$gte": start, "$lt": end}
+
+
+def _hourly_pipeline(source: HourlySource, match: dict, include_archive: bool = False) -> list:
+    date = "$completed_at"
+    if source.date_field == "created_at":
+        date = {"$dateFromString": {"dateString": "$created_at"}}
+    bucket = {"$dateToString": {"format": HOUR_FORMAT, "date": date, "timezone": reporting_timezone().key}}
+    pipeline = [{"$match": {"$and": [source.match, {source.date_field: {"$ne": None}}, match]}}]
+    if include_archive:
+        pipeline.append({"$unionWith": {"coll": ARCHIVE_COLLECTION, "pipeline": [pipeline[0]]}})
+    if source.unwind:
+        pipeline.append({"$unwind": source.unwind})
+    pipeline.append({"$group": {"_id": {**source.group, "bucket": bucket}, **source.accumulators}})
+    return pipeline
+
+
+def _daily_pipeline(stats: StatsCollection, match: dict) -> list:
+    return [
+        {"$match": {"period": "hour", **match}},
+        {"$sort": {"bucket": 1}},
+        {"$group": {
+            "_id": {**{key: f"${key}" for key in stats.keys}, "bucket": {"$substrBytes": ["$bucket", 0, 10]}},
+            **{field: {"$sum": f"${field}"} for field in stats.fields},
+            **{label: {"$last": f"${label}"} for label in stats.labels},
+        }},
+    ]
+
+
+async def _write(collection, period: str, rows, fields: tuple) -> set:
+    """Upsert aggregated rows as ``period`` buckets; returns the filters written."""
+    written, ops = set(), []
+
+    async def flush():
+        if ops:
+            await collection.bulk_write(ops, ordered=False)
+            ops.clear()
+
+    async for row in rows:
+        key = {**row['_id'], "period": period}
+        ops.append(UpdateOne(key, {"$set": {field: row[field] for field in fields if field in row}}, upsert=True))
+        written.add(tuple(sorted(key.items())))
+        if len(ops) >= BATCH_SIZE:
+            await flush()
+    await flush()
+    return written
+
+
+async def _zero_stale(collection, stats: StatsCollection, match: dict, written: set, fields: tuple) -> None:
+    # A bucket whose orders have all left it (reopened, say) drops to zero
+    projection = {"_id": 1, "period": 1, "bucket": 1, **{key: 1 for key in stats.keys}}
+    async for doc in collection.find(match, projection):
+        doc_id = doc.pop("_id")
+        if tuple(sorted(doc.items())) not in written:
+            await collection.update_one({"_id": doc_id}, {"$set": {field: 0 for field in fields}})
+
+
+async def refresh_hour(db, scope: dict, hour: str) -> None:
+    """Recompute one shop's or agent's rollups for ``hour`` and its day.
+
+    ``scope`` is ``{"shop_id": ...}`` or ``{"agent_id": ...}``. Reads only
+    the live orders collection, which still holds every order of any hour
+    recent enough to change.
+    """
+    (scope_key, scope_value), = scope.items()
+    refreshed = set()
+    for source in SOURCES:
+        if source.scope[0] != scope_key:
+            continue
+        collection = db[source.stats.name]
+        match = {source.scope[1]: scope_value, source.date_field: _hour_range(source, hour)}
+        fields = tuple(source.accumulators)
+        written = await _write(collection, "hour", db.orders.aggregate(_hourly_pipeline(source, match)), fields)
+        await _zero_stale(collection, source.stats, {scope_key: scope_value, "period": "hour", "bucket": hour}, written, fields)
+        refreshed.add(source.stats)
+
+    day = hour[:10]
+    for stats in refreshed:
+        collection = db[stats.name]
+        hours = {scope_key: scope_value, "bucket": {"$gte": f"{day}T00", "$lte": f"{day}T23"}}
+        fields = stats.fields + stats.labels
+        written = await _write(collection, "day", collection.aggregate(_daily_pipeline(stats, hours)), fields)
+        await _zero_stale(collection, stats, {scope_key: scope_value, "period": "day", "bucket": day}, written, stats.fields)
+
+
+def order_rollups(order: dict, placed: bool = False) -> list:
+    """``(scope, hour)`` pairs whose rollups count ``order``: the hour it was
+    placed in if ``placed``, and the hour it was completed in, if it was."""
+    pairs = []
+    if placed and order.get('created_at'):
+        pairs.append(({"shop_id": order['shop_id']}, hour_bucket(order['created_at'])))
+    if order.get('completed_at'):
+        hour = hour_bucket(order['completed_at'])
+        pairs.append(({"shop_id": order['shop_id']}, hour))
+        if order.get('delivery_agent_id'):
+            pairs.append(({"agent_id": order['delivery_agent_id']}, hour))
+    return pairs
+
+
+async def backfill(db, since: Optional[datetime] = None) -> None:
+    """Rebuild the rollups from every order, archived ones included, from ``since`` on."""
+    await backfill_completed_at(db.orders)
+    since_hour = _local(since).strftime(HOUR_FORMAT) if since else None
+    for source in SOURCES:
+        match = {}
+        if since:
+            since_utc = since.astimezone(timezone.utc)
+            match[source.date_field] = {
+                "$gte": since_utc.strftime(CREATED_AT_PREFIX) if source.date_field == "created_at" else since_utc
+            }
+        rows = db.orders.aggregate(_hourly_pipeline(source, match, include_archive=True), allowDiskUse=True)
+        await _write(db[source.stats.name], "hour", rows, tuple(source.accumulators))
+    for stats in (SHOP_STATS, PRODUCT_STATS, AGENT_STATS):
+        match = {"bucket": {"$gte": since_hour}} if since else {}
+        rows = db[stats.name].aggregate(_daily_pipeline(stats, match), allowDiskUse=True)
+        await _write(db[stats.name], "day", rows, stats.fields + stats.labels)
+
+
+class StatsRange:
+    """Query parameters shared by the dashboard endpoints; both ends are
+    inclusive, and times without an offset are in the reporting timezone."""
+
+    def __init__(
+        self,
+        period: Literal["hour", "day"] = "day",
+        start: Optional[datetime] = None,
+        end: Optional[datetime] = None
+    ):
+        zone = reporting_timezone()
+        end = end.replace(tzinfo=end.tzinfo or zone).astimezone(zone) if end else datetime.now(zone)
+        start = start.replace(tzinfo=start.tzinfo or zone).astimezone(zone) if start else end - DEFAULT_SPAN[period]
+        step = timedelta(hours=1) if period == "hour" else timedelta(days=1)
+        if start > end or (end - start) / step >= MAX_BUCKETS[period]:
+            raise HTTPException(
+                status_code=400, detail=f"Range must be ordered and span at most {MAX_BUCKETS[period]} {period}s"
+            )
+        bucket_format = HOUR_FORMAT if period == "hour" else DAY_FORMAT
+        self.period = period
+        self.first = start.strftime(bucket_format)
+        self.last = end.strftime(bucket_format)
+
+    def match(self) -> dict:
+        return {"period": self.period, "bucket": {"$gte": self.first, "$lte": self.last}}
+
+
+async def stats_series(collection, stats: StatsCollection, scope: dict, window: StatsRange) -> dict:
+    """Non-empty buckets in ``window`` for one subject, oldest first, with totals."""
+    projection = {"_id": 0, "bucket": 1, **{field: 1 for field in stats.fields}}
+    series = await collection.find({**scope, **window.match()}, projection).sort("bucket", 1).to_list(None)
+    totals = {field: sum(row.get(field, 0) for row in series) for field in stats.fields}
+    return {"period": window.period, "start": window.first, "end": window.last, "series": series, "totals": totals}
+
+
+async def top_products(collection, shop_id: str, window: StatsRange, limit: int) -> list:
+    return await collection.aggregate([
+        {"$match": {"shop_id": shop_id, **window.match()}},
+        {"$sort": {"bucket": 1}},
+        {"$group": {
+            "_id": "$product_id",
+            "product_name": {"$last": "$product_name"},
+            "quantity": {"$sum": "$quantity"},
+            "revenue": {"$sum": "$revenue"},
+        }},
+        {"$sort": {"revenue": -1, "_id": 1}},
+        {"$limit": limit},
+        {"$project": {"_id": 0, "product_id": "$_id", "product_name": 1, "quantity": 1, "revenue": 1}},
+    ]).to_list(limit)
+
+
+def with_average_delivery(row: dict) -> dict:
+    deliveries = row.get('deliveries', 0)
+    row['avg_delivery_minutes'] = round(row.get('delivery_seconds', 0) / deliveries / 60, 1) if deliveries else None
+    return row
+
+
+async def main(mongo_url: str, db_name: str, since: Optional[str]) -> None:
+    client = AsyncIOMotorClient(mongo_url)
+    try:
+        start = datetime.strptime(since, DAY_FORMAT).replace(tzinfo=reporting_timezone()) if since else None
+        await backfill(client[db_name], start)
+    finally:
+        client.close()
+    print("Rollups rebuilt" + (f" from {since}" if since else ""))
+
+
+if __name__ == "__main__":
+    load_dotenv(Path(__file__).parent / '.env')
+    parser = argparse.ArgumentParser(description="Rebuild SamaanDena order rollups")
+    parser.add_argument("--mongo-url", default=os.environ.get('MONGO_URL'))
+    parser.add_argument("--db-name", default=os.environ.get('DB_NAME'))
+    parser.add_argument("--since", help="first local day to rebuild, YYYY-MM-DD (default: all time)")
+    args = parser.parse_args()
+    if not args.mongo_url or not args.db_name:
+        parser.error("MONGO_URL and DB_NAME must be set or passed as arguments")
+    asyncio.run(main(args.mongo_url, args.db_name, args.since))
@@ -0,0 +1,99 @@
+"""Move finished orders out of the hot ``orders`` collection.
+
+Delivered and cancelled orders get a ``completed_at`` datetime when they
+reach that status. Once it is older than the cutoff they are copied to
+``orders_archive`` and deleted from ``orders``, in batches. Each step is
+idempotent, so several workers may run the job at once and an interrupted
+run picks up where it stopped. The API runs it periodically; to run it by
+hand:
+
+    python archive.py [--older-than-days 30] [--mongo-url URL] [--db-name NAME]
+"""
+import argparse
+import asyncio
+import logging
+import os
+import random
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+from dotenv import load_dotenv
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ReplaceOne
+from pymongo.errors import PyMongoError
+
+logger = logging.getLogger(__name__)
+
+TERMINAL_STATUSES = ['delivered', 'cancelled']
+ARCHIVE_COLLECTION = 'orders_archive'
+BATCH_SIZE = 1000
+
+
+async def backfill_completed_at(orders) -> int:
+    """Stamp finished orders from before ``completed_at`` existed with their last update time."""
+    result = await orders.update_many(
+        {"status": {"$in": TERMINAL_STATUSES}, "completed_at": None},
+        [{"$set": {"completed_at": {"$dateFromString": {"dateString": "$updated_at", "onError": "$$NOW", "onNull": "$$NOW"}}}}]
+    )
+    return result.modified_count
+
+
+async def archive_orders(db, older_than: timedelta, batch_size: int = BATCH_SIZE) -> int:
+    """Archive orders finished before ``now - older_than``; returns how many moved."""
+    await backfill_completed_at(db.orders)
+    query = {"status": {"$in": TERMINAL_STATUSES}, "completed_at": {"$lte": datetime.now(timezone.utc) - older_than}}
+    archive = db[ARCHIVE_COLLECTION]
+    moved = 0
+    while True:
+        batch = await db.orders.find(query, {"_id": 0}).limit(batch_size).to_list(batch_size)
+        if not batch:
+            return moved
+        archived_at = datetime.now(timezone.utc)
+        await archive.bulk_write(
+            [ReplaceOne({"id": order['id']}, {**order, "archived_at": archived_at}, upsert=True) for order in batch],
+            ordered=False
+        )
+        ids = [order['id'] for order in batch]
+        result = await db.orders.delete_many({"$and": [{"id": {"$in": ids}}, query]})
+        if result.deleted_count < len(ids):
+            # Reopened between the copy and the delete: the live copy wins
+            live = await db.orders.distinct("id", {"id": {"$in": ids}})
+            if live:
+                await archive.delete_many({"id": {"$in": live}})
+        moved += result.deleted_count
+        if len(batch) < batch_size:
+            return moved
+
+
+async def run_periodically(db, older_than: timedelta, interval: float) -> None:
+    # Jittered so that workers started together do not all run at once
+    await asyncio.sleep(random.uniform(0, interval))
+    while True:
+        try:
+            moved = await archive_orders(db, older_than)
+            if moved:
+                logger.info("Archived %d orders", moved)
+        except PyMongoError:
+            logger.exception("Order archival failed")
+        await asyncio.sleep(interval)
+
+
+async def main(mongo_url: str, db_name: str, older_than_days: float) -> None:
+    client = AsyncIOMotorClient(mongo_url)
+    try:
+        moved = await archive_orders(client[db_name], timedelta(days=older_than_days))
+    finally:
+        client.close()
+    print(f"Archived {moved} orders")
+
+
+if __name__ == "__main__":
+    load_dotenv(Path(__file__).parent / '.env')
+    parser = argparse.ArgumentParser(description="Archive finished SamaanDena orders")
+    parser.add_argument("--mongo-url", default=os.environ.get('MONGO_URL'))
+    parser.add_argument("--db-name", default=os.environ.get('DB_NAME'))
+    parser.add_argument("--older-than-days", type=float, default=float(os.environ.get('ORDER_ARCHIVE_AFTER_DAYS', 30)))
+    args = parser.parse_args()
+    if not args.mongo_url or not args.db_name:
+        parser.error("MONGO_URL and DB_NAME must be set or passed as arguments")
+    asyncio.run(main(args.mongo_url, args.db_name, args.older_than_days))
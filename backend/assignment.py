@@ -0,0 +1,219 @@
+"""Automatic delivery-agent assignment for pending orders.
+
+For each shop with pending orders, the nearest delivery agents are found with
+one ``$geoNear`` query on the users 2dsphere index. Their current load comes
+from one aggregation over active orders. Orders are then handed out oldest
+first to the candidate with the best score, which combines:
+
+* distance from the agent to the shop (the leg that differs per agent),
+* the agent's active order count, so work is spread out,
+* the agent's rating.
+
+Run as a dispatcher over every pending order, or benchmark the planner on
+synthetic data:
+
+    python assignment.py [--limit N]
+    python assignment.py --benchmark [--agents N] [--orders N]
+"""
+import argparse
+import asyncio
+import math
+import os
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+from dotenv import load_dotenv
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ReturnDocument
+
+ACTIVE_STATUSES = ['assigned', 'picked_up']
+
+SEARCH_RADIUS_KM = 15.0
+CANDIDATES_PER_SHOP = 20
+MAX_ACTIVE_ORDERS = 5
+LOAD_WEIGHT_KM = 2.0
+RATING_WEIGHT_KM = 0.5
+
+
+def haversine_km(a: list, b: list) -> float:
+    """Great-circle distance between two [lng, lat] points."""
+    lng1, lat1, lng2, lat2 = map(math.radians, (a[0], a[1], b[0], b[1]))
+    h = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lng2 - lng1) / 2) ** 2
+    return 2 * 6371.0088 * math.asin(math.sqrt(h))
+
+
+def plan_assignments(
+    orders: list,
+    candidates: dict,
+    loads: dict,
+    shop_points: dict,
+    max_active: int = MAX_ACTIVE_ORDERS
+) -> list:
+    """Pick an agent for each order, oldest first.
+
+    ``candidates`` maps shop id to nearby agents (``id``, ``distance_km``,
+    ``rating``); ``loads`` maps agent id to active order count and is not
+    modified. Orders with no agent under ``max_active`` are left out.
+    """
+    loads = dict(loads)
+    plan = []
+    for order in orders:
+        best, best_score = None, math.inf
+        for agent in candidates.get(order['shop_id'], ()):
+            load = loads.get(agent['id'], 0)
+            if load >= max_active:
+                continue
+            score = agent['distance_km'] + LOAD_WEIGHT_KM * load - RATING_WEIGHT_KM * agent.get('rating', 0)
+            if score < best_score:
+                best, best_score = agent, score
+        if best is None:
+            continue
+        loads[best['id']] = loads.get(best['id'], 0) + 1
+
+        trip_km = best['distance_km']
+        drop = order.get('delivery_location') or {}
+        shop_point = shop_points.get(order['shop_id'])
+        if shop_point and 'lat' in drop and 'lng' in drop:
+            trip_km += haversine_km(shop_point, [drop['lng'], drop['lat']])
+        plan.append({
+            "order_id": order['id'],
+            "agent_id": best['id'],
+            "distance_to_shop_km": round(best['distance_km'], 3),
+            "trip_km": round(trip_km, 3),
+        })
+    return plan
+
+
+async def nearby_agents(db, point: dict, radius_km: float, limit: int) -> list:
+    return await db.users.aggregate([
+        {"$geoNear": {
+            "near": point,
+            "distanceField": "distance_km",
+            "distanceMultiplier": 0.001,
+            "maxDistance": radius_km * 1000,
+            "key": "geo",
+            "query": {"role": "delivery_agent"},
+            "spherical": True,
+        }},
+        {"$limit": limit},
+        {"$project": {"_id": 0, "id": 1, "rating": 1, "distance_km": 1}},
+    ]).to_list(limit)
+
+
+async def active_loads(db, agent_ids: list) -> dict:
+    counts = await db.orders.aggregate([
+        {"$match": {"delivery_agent_id": {"$in": agent_ids}, "status": {"$in": ACTIVE_STATUSES}}},
+        {"$group": {"_id": "$delivery_agent_id", "count": {"$sum": 1}}},
+    ]).to_list(None)
+    return {c['_id']: c['count'] for c in counts}
+
+
+async def assign_pending(
+    db,
+    orders: list,
+    radius_km: float = SEARCH_RADIUS_KM,
+    candidates_per_shop: int = CANDIDATES_PER_SHOP,
+    max_active: int = MAX_ACTIVE_ORDERS
+) -> list:
+    """Assign agents to ``orders`` and return the orders that were updated."""
+    shop_ids = list({order['shop_id'] for order in orders})
+    shops = await db.shops.find(
+        {"id": {"$in": shop_ids}, "geo": {"$ne": None}}, {"_id": 0, "id": 1, "geo": 1}
+    ).to_list(None)
+    nearby = await asyncio.gather(*[
+        nearby_agents(db, shop['geo'], radius_km, candidates_per_shop) for shop in shops
+    ])
+    candidates = {shop['id']: agents for shop, agents in zip(shops, nearby)}
+    shop_points = {shop['id']: shop['geo']['coordinates'] for shop in shops}
+    agent_ids = list({agent['id'] for agents in nearby for agent in agents})
+    loads = await active_loads(db, agent_ids) if agent_ids else {}
+
+    assigned = []
+    for item in plan_assignments(orders, candidates, loads, shop_points, max_active):
+        # Only take orders nobody has assigned in the meantime
+        updated = await db.orders.find_one_and_update(
+            {"id": item['order_id'], "status": "pending", "delivery_agent_id": None},
+            {"$set": {
+                "delivery_agent_id": item['agent_id'],
+                "status": "assigned",
+                "updated_at": datetime.now(timezone.utc).isoformat(),
+            }},
+            projection={"_id": 0},
+            return_document=ReturnDocument.AFTER
+        )
+        if updated:
+            assigned.append(updated)
+    return assigned
+
+
+def benchmark(n_agents: int, n_orders: int, n_shops: int = 500) -> None:
+    import numpy as np
+
+    rng = np.random.default_rng(42)
+    # Roughly one district, ~100 km across
+    shop_points = rng.random((n_shops, 2)) + [77.0, 28.0]
+    agent_points = rng.random((n_agents, 2)) + [77.0, 28.0]
+    ratings = rng.uniform(3, 5, n_agents)
+    drops = rng.random((n_orders, 2)) + [77.0, 28.0]
+    order_shops = rng.integers(0, n_shops, n_orders)
+
+    # Stand-in for the per-shop $geoNear queries: a vectorised haversine matrix
+    start = time.perf_counter()
+    lng1, lat1 = np.radians(shop_points).T[:, :, None]
+    lng2, lat2 = np.radians(agent_points).T[:, None, :]
+    h = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lng2 - lng1) / 2) ** 2
+    distances = 2 * 6371.0088 * np.arcsin(np.sqrt(h))
+    nearest = np.argsort(distances, axis=1)[:, :CANDIDATES_PER_SHOP]
+    candidates = {
+        f"shop-{s}": [
+            {"id": f"agent-{a}", "rating": float(ratings[a]), "distance_km": float(distances[s, a])}
+            for a in nearest[s] if distances[s, a] <= SEARCH_RADIUS_KM
+        ]
+        for s in range(n_shops)
+    }
+    shops = {f"shop-{s}": shop_points[s].tolist() for s in range(n_shops)}
+    orders = [
+        {"id": f"order-{i}", "shop_id": f"shop-{order_shops[i]}",
+         "delivery_location": {"lng": float(drops[i, 0]), "lat": float(drops[i, 1])}}
+        for i in range(n_orders)
+    ]
+    prepared = time.perf_counter()
+    plan = plan_assignments(orders, candidates, {}, shops)
+    done = time.perf_counter()
+
+    print(f"{n_agents} agents, {n_orders} orders, {n_shops} shops")
+    print(f"  candidate search (in-memory stand-in): {(prepared - start) * 1000:.1f} ms")
+    print(f"  planning: {(done - prepared) * 1000:.1f} ms, {len(plan)} assigned "
+          f"({n_orders / max(done - prepared, 1e-9):,.0f} orders/s)")
+
+
+async def main(mongo_url: str, db_name: str, limit: int) -> None:
+    client = AsyncIOMotorClient(mongo_url)
+    try:
+        db = client[db_name]
+        orders = await db.orders.find(
+            {"status": "pending", "delivery_agent_id": None}, {"_id": 0}
+        ).sort("created_at", 1).to_list(limit)
+        assigned = await assign_pending(db, orders)
+    finally:
+        client.close()
+    print(f"Assigned {len(assigned)} of {len(orders)} pending orders")
+
+
+if __name__ == "__main__":
+    load_dotenv(Path(__file__).parent / '.env')
+    parser = argparse.ArgumentParser(description="Assign delivery agents to pending orders")
+    parser.add_argument("--mongo-url", default=os.environ.get('MONGO_URL'))
+    parser.add_argument("--db-name", default=os.environ.get('DB_NAME'))
+    parser.add_argument("--limit", type=int, default=1000)
+    parser.add_argument("--benchmark", action="store_true", help="time the planner on synthetic data")
+    parser.add_argument("--agents", type=int, default=5000)
+    parser.add_argument("--orders", type=int, default=5000)
+    args = parser.parse_args()
+    if args.benchmark:
+        benchmark(args.agents, args.orders)
+    else:
+        if not args.mongo_url or not args.db_name:
+            parser.error("MONGO_URL and DB_NAME must be set or passed as arguments")
+        asyncio.run(main(args.mongo_url, args.db_name, args.limit))
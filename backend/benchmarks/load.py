@@ -0,0 +1,309 @@
+"""Load-test the API end to end and record latency per endpoint.
+
+Seeds a database with realistic volumes of users, shops, products, orders and
+reviews, then drives each endpoint with concurrent async requests and reports
+requests/sec and p50/p95/p99 latency. Results are written as JSON so runs can
+be compared across commits.
+
+By default the app runs in-process against a throwaway database on the
+MongoDB at --mongo-url. Pass --mock to use mongomock-motor instead. Endpoints
+that need server-side features mongomock lacks (geo, text search,
+$lookup with let) are skipped. Pass --base-url to drive an already running
+server; it must be pointed at the same database, which is seeded first,
+and started with RATE_LIMIT_ENABLED=false.
+
+    python benchmarks/load.py --mock --requests 200 --concurrency 20
+    python benchmarks/load.py --mongo-url mongodb://localhost:27017 -o after.json --compare before.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+import httpx
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BACKEND_DIR))
+
+PASSWORD = 'bench-password'
+CATEGORIES = ['Groceries', 'Dairy', 'Vegetables', 'Fruits', 'Snacks', 'Household', 'Personal Care']
+PRODUCT_NAMES = ['Atta', 'Rice', 'Dal', 'Sugar', 'Salt', 'Mustard Oil', 'Milk', 'Paneer', 'Onion', 'Potato',
+                 'Tomato', 'Banana', 'Biscuits', 'Namkeen', 'Soap', 'Detergent', 'Tea', 'Ghee', 'Besan', 'Poha']
+STATUSES = ['pending', 'assigned', 'picked_up', 'delivered', 'delivered', 'delivered']
+
+
+def random_point(rng: random.Random) -> dict:
+    # One district, roughly 100 km across
+    return {"lat": 28.0 + rng.random(), "lng": 77.0 + rng.random()}
+
+
+def build_dataset(args, password_hash: str) -> dict:
+    rng = random.Random(args.seed)
+    start = datetime.now(timezone.utc) - timedelta(days=90)
+
+    def timestamp() -> str:
+        return (start + timedelta(seconds=rng.randrange(90 * 86400))).isoformat()
+
+    def user(role: str, i: int) -> dict:
+        location = random_point(rng)
+        doc = {
+            "id": str(uuid.uuid4()), "email": f"{role}{i}@bench.example.com", "phone": f"+91{rng.randrange(10**9, 10**10)}",
+            "name": f"{role.replace('_', ' ').title()} {i}", "role": role, "location": location, "rating": 0.0,
+            "total_reviews": 0, "created_at": timestamp(), "password": password_hash,
+        }
+        if role == 'delivery_agent':
+            doc["geo"] = {"type": "Point", "coordinates": [location['lng'], location['lat']]}
+        return doc
+
+    customers = [user('customer', i) for i in range(args.customers)]
+    owners = [user('shop_owner', i) for i in range(args.owners)]
+    agents = [user('delivery_agent', i) for i in range(args.agents)]
+
+    shops, products = [], []
+    for i in range(args.shops):
+        location = random_point(rng)
+        shop = {
+            "id": str(uuid.uuid4()), "owner_id": rng.choice(owners)['id'], "name": f"Kirana Store {i}",
+            "description": "General store", "location": location, "address": f"Main Bazaar, Village {i}",
+            "phone": "+919800000000", "geo": {"type": "Point", "coordinates": [location['lng'], location['lat']]},
+            "rating": 0.0, "total_reviews": 0, "is_active": True, "created_at": timestamp(),
+        }
+        shops.append(shop)
+        for j in range(args.products_per_shop):
+            name = f"{rng.choice(PRODUCT_NAMES)} {j}"
+            products.append({
+                "id": str(uuid.uuid4()), "shop_id": shop['id'], "name": name, "description": f"{name} 1kg pack",
+                "price": round(rng.uniform(10, 500), 2), "category": rng.choice(CATEGORIES), "image_url": None,
+                "stock": rng.randrange(20, 200), "is_available": True, "created_at": timestamp(),
+            })
+
+    products_by_shop = {}
+    for product in products:
+        products_by_shop.setdefault(product['shop_id'], []).append(product)
+
+    orders = []
+    for _ in range(args.orders):
+        shop = rng.choice(shops)
+        picked = rng.sample(products_by_shop[shop['id']], k=min(3, len(products_by_shop[shop['id']])))
+        items = [{"product_id": p['id'], "product_name": p['name'], "quantity": rng.randrange(1, 4), "price": p['price']}
+                 for p in picked]
+        status = rng.choice(STATUSES)
+        created = timestamp()
+        orders.append({
+            "id": str(uuid.uuid4()), "customer_id": rng.choice(customers)['id'], "shop_id": shop['id'], "items": items,
+            "total_amount": sum(i['price'] * i['quantity'] for i in items), "delivery_address": "Ward 3, Near School",
+            "delivery_location": random_point(rng), "status": status,
+            "delivery_agent_id": None if status == 'pending' else rng.choice(agents)['id'],
+            "created_at": created, "updated_at": created,
+        })
+
+    reviews = [{
+        "id": str(uuid.uuid4()), "reviewer_id": rng.choice(customers)['id'], "target_id": rng.choice(shops)['id'],
+        "target_type": "shop", "rating": rng.randrange(1, 6), "comment": "Good service", "created_at": timestamp(),
+    } for _ in range(args.reviews)]
+
+    return {"users": customers + owners + agents, "shops": shops, "products": products, "orders": orders,
+            "reviews": reviews, "customers": customers, "owners": owners, "agents": agents,
+            "products_by_shop": products_by_shop}
+
+
+async def seed(db, data: dict, mock: bool) -> None:
+    from indexes import create_indexes
+
+    for collection in ('users', 'shops', 'products', 'orders', 'reviews'):
+        await db[collection].drop()
+        docs = data[collection]
+        for i in range(0, len(docs), 5000):
+            # insert_many adds _id to the dicts; copies keep the dataset reusable
+            await db[collection].insert_many([dict(doc) for doc in docs[i:i + 5000]])
+    if not mock:
+        await create_indexes(db)
+
+
+def scenarios(data: dict, rng: random.Random, tokens) -> list:
+    """(name, method, url builder, json builder, needs a real MongoDB, request share)."""
+    def auth(user):
+        return {"Authorization": f"Bearer {tokens(user)}"}
+
+    def shop_near():
+        p = random_point(rng)
+        return f"/api/shops?lat={p['lat']}&lng={p['lng']}&radius_km=10&limit=20"
+
+    def place_order():
+        product = rng.choice(data['products_by_shop'][rng.choice(data['shops'])['id']])
+        return {"shop_id": product['shop_id'], "items": [{"product_id": product['id'], "quantity": 1}],
+                "delivery_address": "Ward 3", "delivery_location": random_point(rng)}
+
+    return [
+        ("GET /api/shops", "GET", lambda: ("/api/shops?limit=100", None), None, False, 1.0),
+        ("GET /api/shops (nearby)", "GET", lambda: (shop_near(), None), None, True, 1.0),
+        ("GET /api/shops/{id}", "GET", lambda: (f"/api/shops/{rng.choice(data['shops'])['id']}", None), None, False, 1.0),
+        ("GET /api/products?shop_id", "GET",
+         lambda: (f"/api/products?shop_id={rng.choice(data['shops'])['id']}", None), None, False, 1.0),
+        ("GET /api/products/search", "GET",
+         lambda: (f"/api/products/search?q={rng.choice(PRODUCT_NAMES)}", None), None, True, 1.0),
+        ("GET /api/reviews/{id}", "GET", lambda: (f"/api/reviews/{rng.choice(data['shops'])['id']}", None), None, False, 1.0),
+        ("GET /api/auth/me", "GET", lambda: ("/api/auth/me", auth(rng.choice(data['customers']))), None, False, 1.0),
+        ("GET /api/orders (customer)", "GET",
+         lambda: ("/api/orders?limit=50", auth(rng.choice(data['customers']))), None, False, 1.0),
+        ("GET /api/orders (agent)", "GET",
+         lambda: ("/api/orders?limit=50", auth(rng.choice(data['agents']))), None, False, 1.0),
+        ("GET /api/orders (shop owner)", "GET",
+         lambda: ("/api/orders?limit=50", auth(rng.choice(data['owners']))), None, True, 1.0),
+        ("POST /api/orders", "POST", lambda: ("/api/orders", auth(rng.choice(data['customers']))), place_order, False, 0.5),
+        ("POST /api/auth/login", "POST", lambda: ("/api/auth/login", None),
+         lambda: {"email": rng.choice(data['customers'])['email'], "password": PASSWORD}, False, 0.1),
+    ]
+
+
+async def drive(client: httpx.AsyncClient, method: str, target, body, requests: int, concurrency: int) -> dict:
+    latencies, errors = [], 0
+    queue = asyncio.Queue()
+    for _ in range(requests):
+        queue.put_nowait(None)
+
+    async def worker():
+        nonlocal errors
+        while not queue.empty():
+            queue.get_nowait()
+            url, headers = target()
+            start = time.perf_counter()
+            try:
+                response = await client.request(method, url, headers=headers, json=body() if body else None)
+                if response.status_code >= 400:
+                    errors += 1
+            except httpx.HTTPError:
+                errors += 1
+            latencies.append((time.perf_counter() - start) * 1000)
+
+    wall = time.perf_counter()
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+    wall = time.perf_counter() - wall
+
+    cuts = statistics.quantiles(latencies, n=100) if len(latencies) > 1 else latencies * 99
+    return {
+        "requests": len(latencies), "errors": errors, "rps": round(len(latencies) / wall, 1),
+        "mean_ms": round(statistics.fmean(latencies), 2), "p50_ms": round(cuts[49], 2),
+        "p95_ms": round(cuts[94], 2), "p99_ms": round(cuts[98], 2),
+    }
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=BACKEND_DIR, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def print_report(results: dict, previous: dict = None) -> None:
+    header = f"{'endpoint':<32}{'req/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'errors':>8}"
+    print(header + ("   p95 vs previous" if previous else ""))
+    for name, r in results.items():
+        line = f"{name:<32}{r['rps']:>9}{r['p50_ms']:>9}{r['p95_ms']:>9}{r['p99_ms']:>9}{r['errors']:>8}"
+        if previous and name in previous:
+            before = previous[name]['p95_ms']
+            line += f"   {((r['p95_ms'] - before) / before * 100 if before else 0):+.1f}%"
+        print(line)
+
+
+async def main(args) -> dict:
+    os.environ['MONGO_URL'] = args.mongo_url or 'mongodb://localhost:27017'
+    os.environ['DB_NAME'] = args.db_name
+    # Every bench request comes from one IP and a handful of users
+    os.environ.setdefault('RATE_LIMIT_ENABLED', 'false')
+    import server
+    server.init_resources()
+
+    if args.mock:
+        try:
+            from mongomock_motor import AsyncMongoMockClient
+        except ImportError:
+            sys.exit("--mock needs mongomock-motor: pip install mongomock-motor")
+        mock_db = AsyncMongoMockClient()[args.db_name]
+        server.db = server.catalogue_db = server.orders_db = server.reviews_db = mock_db
+        server.job_queue.collection = mock_db.jobs
+        server._transactions_supported = False
+
+    password_hash = await server.password_hasher.hash(PASSWORD)
+    data = build_dataset(args, password_hash)
+    print(f"Seeding {len(data['users'])} users, {len(data['shops'])} shops, {len(data['products'])} products, "
+          f"{len(data['orders'])} orders, {len(data['reviews'])} reviews...")
+    await seed(server.db, data, args.mock)
+
+    token_cache = {}
+
+    def tokens(user):
+        if user['id'] not in token_cache:
+            token_cache[user['id']] = server.create_token(user['id'], user['role'])
+        return token_cache[user['id']]
+
+    if args.base_url:
+        client = httpx.AsyncClient(base_url=args.base_url, timeout=30)
+    else:
+        client = httpx.AsyncClient(transport=httpx.ASGITransport(app=server.app), base_url='http://bench', timeout=30)
+
+    rng = random.Random(args.seed)
+    results = {}
+    async with client:
+        for name, method, target, body, needs_mongo, share in scenarios(data, rng, tokens):
+            if needs_mongo and args.mock:
+                print(f"  skipping {name} (needs a real MongoDB)")
+                continue
+            if args.only and not any(part in name for part in args.only):
+                continue
+            requests = max(10, int(args.requests * share))
+            results[name] = await drive(client, method, target, body, requests, args.concurrency)
+            print(f"  {name}: {results[name]['rps']} req/s, p95 {results[name]['p95_ms']} ms")
+
+    if not args.mock and not args.keep:
+        await server.client.drop_database(args.db_name)
+    server.close_resources()
+    return {
+        "meta": {
+            "commit": git_commit(), "timestamp": datetime.now(timezone.utc).isoformat(),
+            "backend": "mongomock" if args.mock else ("http" if args.base_url else "mongodb"),
+            "concurrency": args.concurrency, "requests": args.requests,
+            "dataset": {k: len(data[k]) for k in ('users', 'shops', 'products', 'orders', 'reviews')},
+        },
+        "results": results,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Seed a database and load-test the SamaanDena API")
+    parser.add_argument("--mongo-url", default=os.environ.get('MONGO_URL'))
+    parser.add_argument("--db-name", default="samaandena_bench", help="dropped and re-seeded on every run")
+    parser.add_argument("--mock", action="store_true", help="use mongomock-motor instead of MongoDB")
+    parser.add_argument("--base-url", help="drive a running server instead of the in-process app")
+    parser.add_argument("--customers", type=int, default=2000)
+    parser.add_argument("--owners", type=int, default=200)
+    parser.add_argument("--agents", type=int, default=300)
+    parser.add_argument("--shops", type=int, default=300)
+    parser.add_argument("--products-per-shop", type=int, default=50)
+    parser.add_argument("--orders", type=int, default=20000)
+    parser.add_argument("--reviews", type=int, default=5000)
+    parser.add_argument("--requests", type=int, default=500, help="requests per endpoint")
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--only", nargs="*", help="only run endpoints whose name contains one of these")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--keep", action="store_true", help="keep the seeded database afterwards")
+    parser.add_argument("-o", "--output", default="bench-results.json")
+    parser.add_argument("--compare", help="previous results JSON to compare against")
+    args = parser.parse_args()
+    if args.mock and args.base_url:
+        parser.error("--mock runs the app in-process and cannot be combined with --base-url")
+
+    report = asyncio.run(main(args))
+    previous = json.loads(Path(args.compare).read_text())['results'] if args.compare else None
+    print()
+    print_report(report['results'], previous)
+    Path(args.output).write_text(json.dumps(report, indent=2))
+    print(f"\nSaved results to {args.output}")
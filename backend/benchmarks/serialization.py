@@ -0,0 +1,71 @@
+"""Compare response serialization for the big list endpoints.
+
+"before" is FastAPI's default path for a handler returning a list of Mongo
+documents (jsonable_encoder + JSONResponse); "after" is the ORJSONResponse
+the list endpoints now build directly from the documents.
+
+    python benchmarks/serialization.py [--orders 1000] [--rounds 200]
+"""
+import argparse
+import json
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, ORJSONResponse
+
+
+def make_orders(n: int) -> list:
+    now = datetime.now(timezone.utc)
+    orders = []
+    for i in range(n):
+        created = (now - timedelta(minutes=i)).isoformat()
+        orders.append({
+            "id": str(uuid.uuid4()),
+            "customer_id": str(uuid.uuid4()),
+            "shop_id": str(uuid.uuid4()),
+            "items": [
+                {"product_id": str(uuid.uuid4()), "product_name": f"Product {j}", "quantity": j + 1, "price": 25.5 * (j + 1)}
+                for j in range(4)
+            ],
+            "total_amount": 255.0,
+            "delivery_address": "Ward 4, Near Panchayat Bhawan, Rampur",
+            "delivery_location": {"lat": 28.6139, "lng": 77.2090},
+            "status": "pending",
+            "delivery_agent_id": None,
+            "created_at": created,
+            "updated_at": created,
+        })
+    return orders
+
+
+def before(docs: list) -> bytes:
+    return JSONResponse(content=jsonable_encoder(docs)).body
+
+
+def after(docs: list) -> bytes:
+    return ORJSONResponse(content=docs).body
+
+
+def run(fn, docs: list, rounds: int) -> float:
+    fn(docs)
+    start = time.perf_counter()
+    for _ in range(rounds):
+        fn(docs)
+    return (time.perf_counter() - start) / rounds
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--orders", type=int, default=1000)
+    parser.add_argument("--rounds", type=int, default=200)
+    args = parser.parse_args()
+
+    docs = make_orders(args.orders)
+    assert json.loads(before(docs)) == json.loads(after(docs))
+    results = {name: run(fn, docs, args.rounds) for name, fn in (("before", before), ("after", after))}
+    print(f"{args.orders} orders per response, {len(after(docs)) / 1024:.0f} KiB")
+    for name, seconds in results.items():
+        print(f"  {name:>6}: {seconds * 1000:7.2f} ms/response  {1 / seconds:8.0f} responses/s")
+    print(f"  speed-up: {results['before'] / results['after']:.1f}x")
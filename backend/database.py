@@ -0,0 +1,104 @@
+"""MongoDB client settings: pool sizing, timeouts, read preferences and write concerns.
+
+Every limit comes from the environment so each deployment can size the pool
+to its worker count. Public catalogue reads (shops, products, reviews) may
+be served by secondaries; order writes wait for a journaled majority, while
+reviews only need the primary's acknowledgement.
+"""
+import os
+import threading
+import time
+from collections import defaultdict
+from typing import Mapping
+
+from pymongo import WriteConcern, monitoring
+from pymongo.read_preferences import SecondaryPreferred
+
+# (environment variable, client option, default)
+CLIENT_SETTINGS = (
+    ('MONGO_MAX_POOL_SIZE', 'maxPoolSize', 100),
+    ('MONGO_MIN_POOL_SIZE', 'minPoolSize', 0),
+    ('MONGO_MAX_IDLE_TIME_MS', 'maxIdleTimeMS', 300000),
+    ('MONGO_WAIT_QUEUE_TIMEOUT_MS', 'waitQueueTimeoutMS', 2000),
+    ('MONGO_SERVER_SELECTION_TIMEOUT_MS', 'serverSelectionTimeoutMS', 5000),
+    ('MONGO_CONNECT_TIMEOUT_MS', 'connectTimeoutMS', 5000),
+    ('MONGO_SOCKET_TIMEOUT_MS', 'socketTimeoutMS', 15000),
+)
+
+ORDER_WRITE_CONCERN = WriteConcern(w='majority', j=True, wtimeout=5000)
+REVIEW_WRITE_CONCERN = WriteConcern(w=1)
+
+
+def client_options(env: Mapping[str, str] = os.environ) -> dict:
+    return {option: int(env.get(name, default)) for name, option, default in CLIENT_SETTINGS}
+
+
+def catalogue_read_preference(env: Mapping[str, str] = os.environ) -> SecondaryPreferred:
+    # MongoDB rejects a max staleness below 90 seconds; -1 means no limit
+    return SecondaryPreferred(max_staleness=int(env.get('MONGO_CATALOGUE_MAX_STALENESS_S', -1)))
+
+
+class PoolTracker(monitoring.ConnectionPoolListener):
+    """Connection pool usage per server, for the health endpoint.
+
+    Pool events fire on Motor's worker threads, hence the lock.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pools = defaultdict(lambda: {
+            "open": 0, "in_use": 0, "checkouts": 0, "checkout_failures": 0, "wait_ms": 0.0, "cleared": 0
+        })
+        self._waiting = {}
+
+    def _update(self, event, **changes) -> None:
+        with self._lock:
+            pool = self._pools[f"{event.address[0]}:{event.address[1]}"]
+            for key, delta in changes.items():
+                pool[key] += delta
+
+    def pool_created(self, event):
+        self._update(event)
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        self._update(event, cleared=1)
+
+    def pool_closed(self, event):
+        with self._lock:
+            self._pools.pop(f"{event.address[0]}:{event.address[1]}", None)
+
+    def connection_created(self, event):
+        self._update(event, open=1)
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        self._update(event, open=-1)
+
+    def connection_check_out_started(self, event):
+        self._waiting[threading.get_ident()] = time.perf_counter()
+
+    def _waited_ms(self) -> float:
+        started = self._waiting.pop(threading.get_ident(), None)
+        return (time.perf_counter() - started) * 1000 if started is not None else 0.0
+
+    def connection_check_out_failed(self, event):
+        self._update(event, checkout_failures=1, wait_ms=self._waited_ms())
+
+    def connection_checked_out(self, event):
+        self._update(event, in_use=1, checkouts=1, wait_ms=self._waited_ms())
+
+    def connection_checked_in(self, event):
+        self._update(event, in_use=-1)
+
+    def stats(self) -> dict:
+        with self._lock:
+            pools = {address: dict(pool) for address, pool in self._pools.items()}
+        for pool in pools.values():
+            wait_ms = pool.pop("wait_ms")
+            pool["avg_wait_ms"] = round(wait_ms / pool["checkouts"], 3) if pool["checkouts"] else 0.0
+        return pools
@@ -0,0 +1,109 @@
+"""Realtime order updates pushed to clients over Server-Sent Events.
+
+Every customer, shop owner and delivery agent linked to an order is told
+about changes to it. With a replica set the events come from a MongoDB
+change stream, so each API worker sees every write. Otherwise the write
+handlers publish directly and only clients on the same worker are told.
+"""
+import asyncio
+import logging
+from collections import defaultdict
+from typing import Optional
+
+import orjson
+from pymongo.errors import OperationFailure, PyMongoError
+
+from cache import TTLCache
+
+logger = logging.getLogger(__name__)
+
+KEEPALIVE_SECONDS = 15
+
+
+class OrderEvents:
+    def __init__(self, queue_size: int = 100):
+        self.queue_size = queue_size
+        self.watching = False
+        self._subscribers = defaultdict(set)
+        self._shop_owners = TTLCache(maxsize=10000, ttl=300)
+
+    def subscribe(self, user_id: str) -> asyncio.Queue:
+        queue = asyncio.Queue(maxsize=self.queue_size)
+        self._subscribers[user_id].add(queue)
+        return queue
+
+    def unsubscribe(self, user_id: str, queue: asyncio.Queue) -> None:
+        queues = self._subscribers.get(user_id)
+        if queues is not None:
+            queues.discard(queue)
+            if not queues:
+                del self._subscribers[user_id]
+
+    async def _shop_owner(self, db, shop_id: str) -> Optional[str]:
+        owner_id = self._shop_owners.get(shop_id)
+        if owner_id is None:
+            shop = await db.shops.find_one({"id": shop_id}, {"_id": 0, "owner_id": 1})
+            owner_id = shop['owner_id'] if shop else None
+            if owner_id:
+                self._shop_owners.set(shop_id, owner_id)
+        return owner_id
+
+    async def publish(self, db, order: dict) -> None:
+        order = {k: v for k, v in order.items() if k != '_id'}
+        recipients = {order.get('customer_id'), order.get('delivery_agent_id')}
+        recipients.add(await self._shop_owner(db, order.get('shop_id')))
+        for user_id in recipients - {None}:
+            for queue in self._subscribers.get(user_id, ()):
+                if queue.full():
+                    # Slow consumer: drop its oldest event rather than block writers
+                    queue.get_nowait()
+                queue.put_nowait(order)
+
+    async def notify(self, db, order: dict) -> None:
+        """Publish from a write handler unless the change stream already will."""
+        if order and not self.watching:
+            await self.publish(db, order)
+
+    async def watch(self, db) -> None:
+        """Feed events from the orders change stream for as long as it is available."""
+        pipeline = [{"$match": {"operationType": {"$in": ["insert", "update", "replace"]}}}]
+        while True:
+            try:
+                async with db.orders.watch(pipeline, full_document='updateLookup') as stream:
+                    self.watching = True
+                    logger.info("Order events fed from MongoDB change stream")
+                    async for change in stream:
+                        if change.get('fullDocument'):
+                            await self.publish(db, change['fullDocument'])
+            except OperationFailure as e:
+                # Standalone servers do not support change streams
+                logger.info("Change streams unavailable (%s); using in-process order events", e)
+                return
+            except PyMongoError as e:
+                logger.warning("Order change stream interrupted: %s", e)
+                await asyncio.sleep(1)
+            finally:
+                self.watching = False
+
+    async def stream(self, request, user_id: str, order_id: Optional[str] = None):
+        """Yield SSE frames for ``user_id`` until the client disconnects."""
+        queue = self.subscribe(user_id)
+        try:
+            yield "retry: 5000\n\n"
+            while not await request.is_disconnected():
+                try:
+                    order = await asyncio.wait_for(queue.get(), timeout=KEEPALIVE_SECONDS)
+                except asyncio.TimeoutError:
+                    yield ": keep-alive\n\n"
+                    continue
+                if order_id and order.get('id') != order_id:
+                    continue
+                yield b"event: order\ndata: " + orjson.dumps(order) + b"\n\n"
+        finally:
+            self.unsubscribe(user_id, queue)
+
+    def stats(self) -> dict:
+        return {
+            "source": "change_stream" if self.watching else "in_process",
+            "subscribers": sum(len(queues) for queues in self._subscribers.values()),
+        }
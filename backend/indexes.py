@@ -0,0 +1,146 @@
+"""MongoDB indexes for every collection the API queries.
+
+Created at app startup and safe to re-run. A fingerprint of the index set is
+stored in the ``meta`` collection once built, so workers starting later skip
+the build. To build them ahead of a deploy:
+
+    python indexes.py [--mongo-url URL] [--db-name NAME]
+"""
+import argparse
+import asyncio
+import hashlib
+import logging
+import os
+from datetime import datetime, timezone
+from pathlib import Path
+
+from dotenv import load_dotenv
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ASCENDING, DESCENDING, GEOSPHERE, TEXT, IndexModel
+
+logger = logging.getLogger(__name__)
+
+INDEXES = {
+    "users": [
+        IndexModel([("id", ASCENDING)], unique=True),
+        IndexModel([("email", ASCENDING)], unique=True),
+        IndexModel([("role", ASCENDING), ("created_at", DESCENDING), ("id", DESCENDING)]),
+        IndexModel([("geo", GEOSPHERE)]),
+    ],
+    "shops": [
+        IndexModel([("id", ASCENDING)], unique=True),
+        IndexModel([("owner_id", ASCENDING), ("created_at", DESCENDING), ("id", DESCENDING)]),
+        IndexModel([("is_active", ASCENDING), ("created_at", DESCENDING), ("id", DESCENDING)]),
+        IndexModel([("geo", GEOSPHERE)]),
+        IndexModel([("updated_at", ASCENDING), ("id", ASCENDING)]),
+    ],
+    "products": [
+        IndexModel([("id", ASCENDING)], unique=True),
+        IndexModel([("shop_id", ASCENDING), ("is_available", ASCENDING), ("created_at", DESCENDING), ("id", DESCENDING)]),
+        IndexModel([("is_available", ASCENDING), ("created_at", DESCENDING), ("id", DESCENDING)]),
+        IndexModel([("shop_id", ASCENDING), ("name", ASCENDING)]),
+        IndexModel([("updated_at", ASCENDING), ("id", ASCENDING)]),
+        IndexModel([("shop_id", ASCENDING), ("updated_at", ASCENDING), ("id", ASCENDING)]),
+        IndexModel(
+            [("name", TEXT), ("category", TEXT), ("description", TEXT)],
+            weights={"name": 10, "category": 5, "description": 1}
+        ),
+    ],
+    "orders": [
+        IndexModel([("id", ASCENDING)], unique=True),
+        IndexModel([("customer_id", ASCENDING), ("created_at", DESCENDING), ("id", DESCENDING)]),
+        IndexModel([("shop_id", ASCENDING), ("created_at", DESCENDING), ("id", DESCENDING)]),
+        IndexModel([("delivery_agent_id", ASCENDING), ("created_at", DESCENDING), ("id", DESCENDING)]),
+        IndexModel([("status", ASCENDING), ("created_at", ASCENDING)]),
+        IndexModel([("status", ASCENDING), ("completed_at", ASCENDING)]),
+        IndexModel([("customer_id", ASCENDING), ("updated_at", ASCENDING), ("id", ASCENDING)]),
+        IndexModel([("shop_id", ASCENDING), ("updated_at", ASCENDING), ("id", ASCENDING)]),
+        IndexModel([("delivery_agent_id", ASCENDING), ("updated_at", ASCENDING), ("id", ASCENDING)]),
+        IndexModel([("shop_id", ASCENDING), ("completed_at", ASCENDING)]),
+        IndexModel([("delivery_agent_id", ASCENDING), ("completed_at", ASCENDING)]),
+    ],
+    "orders_archive": [
+        IndexModel([("id", ASCENDING)], unique=True),
+        IndexModel([("customer_id", ASCENDING), ("created_at", DESCENDING), ("id", DESCENDING)]),
+        IndexModel([("shop_id", ASCENDING), ("created_at", DESCENDING), ("id", DESCENDING)]),
+        IndexModel([("delivery_agent_id", ASCENDING), ("created_at", DESCENDING), ("id", DESCENDING)]),
+    ],
+    "reviews": [
+        IndexModel([("id", ASCENDING)], unique=True),
+        IndexModel([("target_id", ASCENDING), ("created_at", DESCENDING), ("id", DESCENDING)]),
+    ],
+    "rate_limits": [
+        IndexModel([("expires_at", ASCENDING)], expireAfterSeconds=0),
+    ],
+    "shop_stats": [
+        IndexModel([("shop_id", ASCENDING), ("period", ASCENDING), ("bucket", ASCENDING)], unique=True),
+    ],
+    "product_stats": [
+        IndexModel(
+            [("shop_id", ASCENDING), ("period", ASCENDING), ("bucket", ASCENDING), ("product_id", ASCENDING)], unique=True
+        ),
+    ],
+    "agent_stats": [
+        IndexModel([("agent_id", ASCENDING), ("period", ASCENDING), ("bucket", ASCENDING)], unique=True),
+    ],
+    "jobs": [
+        IndexModel([("id", ASCENDING)], unique=True),
+        IndexModel([("status", ASCENDING), ("run_at", ASCENDING)]),
+        IndexModel([("status", ASCENDING), ("locked_until", ASCENDING)]),
+        IndexModel(
+            [("key", ASCENDING)], unique=True,
+            partialFilterExpression={"status": "queued", "key": {"$exists": True}}
+        ),
+        IndexModel([("finished_at", ASCENDING)], expireAfterSeconds=7 * 24 * 3600),
+    ],
+}
+
+
+def index_fingerprint() -> str:
+    spec = repr(sorted((collection, [model.document for model in models]) for collection, models in INDEXES.items()))
+    return hashlib.sha256(spec.encode()).hexdigest()[:16]
+
+
+async def indexes_current(db) -> bool:
+    """Whether the current index set has already been built on ``db``."""
+    marker = await db.meta.find_one({"_id": "indexes"}, {"fingerprint": 1})
+    return marker is not None and marker.get("fingerprint") == index_fingerprint()
+
+
+async def create_indexes(db) -> dict:
+    """Create any missing indexes and return the names built, per collection."""
+    built = {}
+    for collection, models in INDEXES.items():
+        existing = await db[collection].index_information()
+        names = await db[collection].create_indexes(models)
+        built[collection] = [name for name in names if name not in existing]
+        if built[collection]:
+            logger.info("Built indexes on %s: %s", collection, ", ".join(built[collection]))
+    await db.meta.update_one(
+        {"_id": "indexes"},
+        {"$set": {"fingerprint": index_fingerprint(), "built_at": datetime.now(timezone.utc).isoformat()}},
+        upsert=True
+    )
+    return built
+
+
+async def main(mongo_url: str, db_name: str) -> None:
+    client = AsyncIOMotorClient(mongo_url)
+    try:
+        built = await create_indexes(client[db_name])
+    finally:
+        client.close()
+    for collection, names in built.items():
+        print(f"{collection}: {', '.join(names) if names else 'up to date'}")
+
+
+if __name__ == "__main__":
+    load_dotenv(Path(__file__).parent / '.env')
+    parser = argparse.ArgumentParser(description="Create SamaanDena MongoDB indexes")
+    parser.add_argument("--mongo-url", default=os.environ.get('MONGO_URL'))
+    parser.add_argument("--db-name", default=os.environ.get('DB_NAME'))
+    args = parser.parse_args()
+    if not args.mongo_url or not args.db_name:
+        parser.error("MONGO_URL and DB_NAME must be set or passed as arguments")
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(main(args.mongo_url, args.db_name))
@@ -0,0 +1,208 @@
+"""Background jobs persisted in MongoDB.
+
+Write handlers enqueue follow-up work (rating updates, say) and return
+straight away; a worker claims due jobs from the ``jobs`` collection and
+runs the registered handler. Claims are leases: a job whose worker died
+is claimed again once ``locked_until`` passes, so handlers run at least
+once and must be safe to repeat. Failures are retried with exponential
+backoff until ``max_attempts``, after which the job is left ``failed``
+for inspection; a keyed job whose key was queued again while it ran is
+closed as ``superseded`` instead of retried. Finished jobs are removed by
+a TTL index.
+
+Each API worker runs one unless ``JOB_WORKER_EMBEDDED=false``; to run jobs
+in a separate process instead:
+
+    python worker.py [--concurrency 4]
+"""
+import asyncio
+import logging
+import random
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Awaitable, Callable, Dict, Optional
+
+from pymongo.errors import DuplicateKeyError, PyMongoError
+
+logger = logging.getLogger(__name__)
+
+Handler = Callable[[dict], Awaitable[None]]
+
+LEASE_SECONDS = 60
+MAX_ATTEMPTS = 5
+BACKOFF_BASE_SECONDS = 2.0
+BACKOFF_MAX_SECONDS = 600.0
+POLL_SECONDS = 1.0
+SHUTDOWN_GRACE_SECONDS = 10.0
+
+
+def backoff(attempts: int) -> float:
+    """Seconds before retry ``attempts + 1``, jittered so failed jobs do not retry in lockstep."""
+    delay = min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * 2 ** (attempts - 1))
+    return delay * random.uniform(0.5, 1.5)
+
+
+class JobQueue:
+    def __init__(self, collection=None, lease_seconds: float = LEASE_SECONDS):
+        self.collection = collection
+        self.lease_seconds = lease_seconds
+        self.handlers: Dict[str, Handler] = {}
+        self.max_attempts: Dict[str, int] = {}
+        self.counts = {"enqueued": 0, "succeeded": 0, "retried": 0, "superseded": 0, "failed": 0}
+        self.running = 0
+        self._wakeup = asyncio.Event()
+
+    def handler(self, name: str, max_attempts: int = MAX_ATTEMPTS):
+        """Register the coroutine run for jobs called ``name``; it receives the job payload."""
+        def register(func: Handler) -> Handler:
+            self.handlers[name] = func
+            self.max_attempts[name] = max_attempts
+            return func
+        return register
+
+    async def enqueue(self, name: str, payload: dict, key: Optional[str] = None, delay: float = 0.0) -> None:
+        """Queue a job to run after ``delay`` seconds.
+
+        Jobs with a ``key`` are coalesced: while one with the same key is
+        still waiting to run, enqueueing another is a no-op.
+        """
+        if name not in self.handlers:
+            raise ValueError(f"No handler registered for job {name!r}")
+        now = datetime.now(timezone.utc)
+        job = {
+            "id": str(uuid.uuid4()),
+            "name": name,
+            "payload": payload,
+            "status": "queued",
+            "attempts": 0,
+            "run_at": now + timedelta(seconds=delay),
+            "created_at": now,
+        }
+        if key is None:
+            await self.collection.insert_one(job)
+        else:
+            try:
+                await self.collection.update_one(
+                    {"key": key, "status": "queued"}, {"$setOnInsert": {**job, "key": key}}, upsert=True
+                )
+            except DuplicateKeyError:
+                # Lost the race to another enqueue of the same key, which is what we wanted anyway
+                pass
+        self.counts["enqueued"] += 1
+        self._wakeup.set()
+
+    async def claim(self) -> Optional[dict]:
+        """Lease the next due job, or a running one whose lease has expired."""
+        now = datetime.now(timezone.utc)
+        lease = str(uuid.uuid4())
+        job = await self.collection.find_one_and_update(
+            {"$or": [
+                {"status": "queued", "run_at": {"$lte": now}},
+                {"status": "running", "locked_until": {"$lte": now}},
+            ]},
+            {
+                "$set": {
+                    "status": "running",
+                    "lease": lease,
+                    "locked_until": now + timedelta(seconds=self.lease_seconds),
+                    "started_at": now,
+                },
+                "$inc": {"attempts": 1},
+            },
+            sort=[("run_at", 1)],
+            projection={"_id": 0, "id": 1, "name": 1, "payload": 1, "attempts": 1}
+        )
+        if job is not None:
+            job.update(lease=lease, attempts=job['attempts'] + 1)
+        return job
+
+    async def _finish(self, job: dict, update: dict) -> bool:
+        # Matching on the lease keeps a worker that overran it from
+        # overwriting the outcome of whichever worker took the job over
+        lease = {"id": job['id'], "lease": job['lease']}
+        unset = {"$unset": {"lease": "", "locked_until": ""}}
+        try:
+            await self.collection.update_one(lease, {"$set": update, **unset})
+            return True
+        except DuplicateKeyError:
+            # Requeueing for a retry, but a job with the same key was queued
+            # while this one ran; that one does the work instead
+            superseded = {"status": "superseded", "error": update.get("error"), "finished_at": datetime.now(timezone.utc)}
+            await self.collection.update_one(lease, {"$set": superseded, **unset})
+            logger.info("Job %s (%s) superseded by a newer job with the same key", job['id'], job['name'])
+            self.counts["superseded"] += 1
+            return False
+
+    async def run(self, job: dict) -> None:
+        handler = self.handlers.get(job['name'])
+        max_attempts = self.max_attempts.get(job['name'], MAX_ATTEMPTS)
+        now = datetime.now(timezone.utc)
+        if handler is None or job['attempts'] > max_attempts:
+            # Unknown jobs come from newer code, or crashed every worker that took them
+            error = "No handler registered" if handler is None else "Lease expired on every attempt"
+            await self._finish(job, {"status": "failed", "error": error, "failed_at": now})
+            self.counts["failed"] += 1
+            return
+        try:
+            await handler(job['payload'])
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+            if job['attempts'] >= max_attempts:
+                logger.exception("Job %s (%s) failed after %d attempts", job['id'], job['name'], job['attempts'])
+                await self._finish(job, {"status": "failed", "error": error, "failed_at": now})
+                self.counts["failed"] += 1
+            else:
+                logger.warning("Job %s (%s) failed, retrying: %s", job['id'], job['name'], error)
+                retry_at = now + timedelta(seconds=backoff(job['attempts']))
+                if await self._finish(job, {"status": "queued", "error": error, "run_at": retry_at}):
+                    self.counts["retried"] += 1
+            return
+        await self._finish(job, {"status": "done", "finished_at": datetime.now(timezone.utc)})
+        self.counts["succeeded"] += 1
+
+    async def _run_guarded(self, job: dict, slots: asyncio.Semaphore) -> None:
+        try:
+            await self.run(job)
+        except PyMongoError:
+            # Could not record the outcome; the lease expiry hands the job to another worker
+            logger.exception("Could not record outcome of job %s", job['id'])
+        finally:
+            self.running -= 1
+            slots.release()
+
+    async def work(self, concurrency: int = 4, poll_interval: float = POLL_SECONDS) -> None:
+        """Claim and run jobs, at most ``concurrency`` at a time, until cancelled.
+
+        On cancellation, jobs already started get a grace period to finish;
+        any still running after it are picked up again when their lease expires.
+        """
+        slots = asyncio.Semaphore(concurrency)
+        tasks = set()
+        try:
+            while True:
+                await slots.acquire()
+                # Cleared before claiming so an enqueue during the claim still wakes us
+                self._wakeup.clear()
+                try:
+                    job = await self.claim()
+                except PyMongoError:
+                    logger.exception("Could not claim a job")
+                    job = None
+                if job is None:
+                    slots.release()
+                    try:
+                        await asyncio.wait_for(self._wakeup.wait(), poll_interval)
+                    except asyncio.TimeoutError:
+                        pass
+                    continue
+                self.running += 1
+                task = asyncio.create_task(self._run_guarded(job, slots))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+        except asyncio.CancelledError:
+            if tasks:
+                await asyncio.wait(tasks, timeout=SHUTDOWN_GRACE_SECONDS)
+            raise
+
+    def stats(self) -> dict:
+        return {**self.counts, "running": self.running, "handlers": sorted(self.handlers)}
@@ -0,0 +1,71 @@
+"""Request-scoped batching loaders.
+
+A :class:`Loader` collects every id asked for within one event-loop tick
+and resolves them with a single ``$in`` query, remembering the results for
+the rest of the request. Handlers that resolve related documents (the
+shops behind a list of orders, say) can ask for them one at a time or all
+at once and still pay for one query per collection.
+"""
+import asyncio
+from typing import Iterable, Optional
+
+MAX_BATCH_IDS = 100
+
+
+class Loader:
+    def __init__(self, collection, projection: dict, fallback=None):
+        """``fallback`` is a second collection searched for ids the first lacks."""
+        self.collection = collection
+        self.projection = projection
+        self.fallback = fallback
+        self._futures = {}
+        self._queue = []
+        self._dispatching = None
+
+    async def _fetch(self, ids: list) -> dict:
+        docs = {}
+        for collection in filter(None, (self.collection, self.fallback)):
+            missing = [doc_id for doc_id in ids if doc_id not in docs]
+            if not missing:
+                break
+            async for doc in collection.find({"id": {"$in": missing}}, self.projection):
+                docs[doc['id']] = doc
+        return docs
+
+    async def _dispatch(self) -> None:
+        ids, self._queue, self._dispatching = self._queue, [], None
+        try:
+            docs = await self._fetch(ids)
+        except Exception as e:
+            for doc_id in ids:
+                # Forget failed ids so a later load can retry them
+                self._futures.pop(doc_id).set_exception(e)
+            return
+        for doc_id in ids:
+            self._futures[doc_id].set_result(docs.get(doc_id))
+
+    async def load_many(self, ids: Iterable[str]) -> dict:
+        """Return ``{id: document}`` for the ids that exist."""
+        ids = list(dict.fromkeys(ids))
+        loop = asyncio.get_running_loop()
+        for doc_id in ids:
+            if doc_id not in self._futures:
+                self._futures[doc_id] = loop.create_future()
+                self._queue.append(doc_id)
+        if self._queue and self._dispatching is None:
+            # Runs once the current tick has queued everything it wants
+            self._dispatching = loop.create_task(self._dispatch())
+        futures = [self._futures[doc_id] for doc_id in ids]
+        docs = await asyncio.gather(*futures)
+        return {doc_id: doc for doc_id, doc in zip(ids, docs) if doc is not None}
+
+    async def load(self, doc_id: str) -> Optional[dict]:
+        return (await self.load_many([doc_id])).get(doc_id)
+
+
+def batch_result(ids: list, docs: dict) -> dict:
+    """Documents in the order requested, plus the ids that were not found or not visible."""
+    return {
+        "items": [docs[doc_id] for doc_id in ids if doc_id in docs],
+        "missing": [doc_id for doc_id in ids if doc_id not in docs],
+    }
@@ -0,0 +1,231 @@
+"""Per-request latency and MongoDB usage, exposed in Prometheus text format.
+
+:class:`MetricsMiddleware` times every request and, through a pymongo
+:class:`CommandTracker` registered on the client, attributes each database
+command to the route that issued it. Motor runs pymongo on worker threads
+but copies the caller's context, so the per-request stats travel in a
+context variable. Requests slower than ``slow_ms`` are logged along with
+their slowest commands.
+"""
+import logging
+import threading
+import time
+from bisect import bisect_left
+from collections import defaultdict
+from contextvars import ContextVar
+from typing import Optional
+
+from pymongo import monitoring
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+DB_OPS_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100)
+MAX_TRACKED_COMMANDS = 100
+SLOW_LOG_COMMANDS = 10
+# Where to find the interesting part of each command for the slow log
+COMMAND_BODY_FIELDS = ('filter', 'pipeline', 'updates', 'deletes', 'q', 'query')
+
+_request_stats: ContextVar[Optional["RequestStats"]] = ContextVar('request_stats', default=None)
+
+
+class RequestStats:
+    __slots__ = ('db_ops', 'db_seconds', 'commands')
+
+    def __init__(self):
+        self.db_ops = 0
+        self.db_seconds = 0.0
+        self.commands = []
+
+
+class Histogram:
+    def __init__(self, buckets: tuple):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+    def samples(self, name: str, labels: str):
+        prefix = f"{labels}," if labels else ""
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            yield f'{name}_bucket{{{prefix}le="{bound}"}} {cumulative}'
+        cumulative += self.counts[-1]
+        yield f'{name}_bucket{{{prefix}le="+Inf"}} {cumulative}'
+        yield f'{name}_sum{{{labels}}} {self.sum}'
+        yield f'{name}_count{{{labels}}} {cumulative}'
+
+
+def _labels(**values) -> str:
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"') for v in values.values())
+    return ",".join(f'{key}="{value}"' for key, value in zip(values, escaped))
+
+
+def _command_body(command: dict) -> str:
+    for field in COMMAND_BODY_FIELDS:
+        if field in command:
+            return repr(command[field])[:300]
+    return ''
+
+
+class CommandTracker(monitoring.CommandListener):
+    """Counts MongoDB commands globally and against the current request."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._started = {}
+        self.commands = defaultdict(lambda: Histogram(LATENCY_BUCKETS))
+        self.failures = defaultdict(int)
+
+    def started(self, event):
+        collection = event.command.get('collection' if event.command_name == 'getMore' else event.command_name)
+        self._started[(event.connection_id, event.request_id)] = (
+            collection if isinstance(collection, str) else '', event.command
+        )
+
+    def _finish(self, event, failed: bool):
+        collection, command = self._started.pop((event.connection_id, event.request_id), ('', {}))
+        seconds = event.duration_micros / 1e6
+        with self._lock:
+            self.commands[(event.command_name, collection)].observe(seconds)
+            if failed:
+                self.failures[(event.command_name, collection)] += 1
+            stats = _request_stats.get()
+            if stats is not None:
+                stats.db_ops += 1
+                stats.db_seconds += seconds
+                if len(stats.commands) < MAX_TRACKED_COMMANDS:
+                    stats.commands.append((seconds, event.command_name, collection, command))
+
+    def succeeded(self, event):
+        self._finish(event, failed=False)
+
+    def failed(self, event):
+        self._finish(event, failed=True)
+
+    def samples(self):
+        with self._lock:
+            commands = list(self.commands.items())
+            failures = list(self.failures.items())
+        yield '# HELP mongodb_command_duration_seconds MongoDB command latency.'
+        yield '# TYPE mongodb_command_duration_seconds histogram'
+        for (name, collection), histogram in sorted(commands):
+            yield from histogram.samples('mongodb_command_duration_seconds', _labels(command=name, collection=collection))
+        yield '# HELP mongodb_command_failures_total MongoDB commands that returned an error.'
+        yield '# TYPE mongodb_command_failures_total counter'
+        for (name, collection), count in sorted(failures):
+            yield f'mongodb_command_failures_total{{{_labels(command=name, collection=collection)}}} {count}'
+
+
+class MetricsMiddleware:
+    """ASGI middleware recording latency, status codes and DB usage per route.
+
+    Routes are labelled by their path template, so ``/api/shops/{shop_id}``
+    is one series however many shops there are.
+    """
+
+    def __init__(self, app, registry: "Metrics"):
+        self.app = app
+        self.registry = registry
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+
+        stats = RequestStats()
+        token = _request_stats.set(stats)
+        status_code, streaming = 500, False
+        start = time.perf_counter()
+
+        async def send_wrapper(message):
+            nonlocal status_code, streaming
+            if message['type'] == 'http.response.start':
+                status_code = message['status']
+                streaming = any(
+                    name == b'content-type' and value.startswith(b'text/event-stream')
+                    for name, value in message.get('headers', [])
+                )
+            await send(message)
+
+        self.registry.in_flight += 1
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            self.registry.in_flight -= 1
+            _request_stats.reset(token)
+            route = scope.get('route')
+            self.registry.observe(
+                scope['method'], route.path if route is not None else 'unmatched', status_code,
+                time.perf_counter() - start, stats, scope, log_slow=not streaming
+            )
+
+
+class Metrics:
+    def __init__(self, slow_ms: float = 500):
+        self.slow_seconds = slow_ms / 1000
+        self.in_flight = 0
+        self.tracker = CommandTracker()
+        self.requests = defaultdict(int)
+        self.latency = defaultdict(lambda: Histogram(LATENCY_BUCKETS))
+        self.db_ops = defaultdict(lambda: Histogram(DB_OPS_BUCKETS))
+        self.db_seconds = defaultdict(float)
+
+    def observe(self, method: str, route: str, status_code: int, seconds: float, stats: RequestStats, scope,
+                log_slow: bool = True) -> None:
+        key = (method, route)
+        self.requests[(method, route, status_code)] += 1
+        self.latency[key].observe(seconds)
+        self.db_ops[key].observe(stats.db_ops)
+        self.db_seconds[key] += stats.db_seconds
+        if log_slow and seconds >= self.slow_seconds:
+            self._log_slow(method, scope, status_code, seconds, stats)
+
+    @staticmethod
+    def _log_slow(method: str, scope, status_code: int, seconds: float, stats: RequestStats) -> None:
+        query = scope.get('query_string', b'').decode('latin-1')
+        path = scope['path'] + (f"?{query}" if query else '')
+        slowest = sorted(stats.commands, key=lambda command: command[0], reverse=True)[:SLOW_LOG_COMMANDS]
+        lines = [
+            f"  {duration * 1000:.1f}ms {name} {collection} {_command_body(command)}"
+            for duration, name, collection, command in slowest
+        ]
+        logger.warning(
+            "Slow request %s %s -> %d in %.1fms (%d db ops, %.1fms in db)%s",
+            method, path, status_code, seconds * 1000, stats.db_ops, stats.db_seconds * 1000,
+            "".join(f"\n{line}" for line in lines)
+        )
+
+    def render(self) -> str:
+        lines = [
+            '# HELP http_requests_in_flight Requests currently being served.',
+            '# TYPE http_requests_in_flight gauge',
+            f'http_requests_in_flight {self.in_flight}',
+            '# HELP http_requests_total Requests served, by route and status code.',
+            '# TYPE http_requests_total counter',
+        ]
+        for (method, route, code), count in sorted(self.requests.items()):
+            lines.append(f'http_requests_total{{{_labels(method=method, route=route, status=code)}}} {count}')
+        lines += [
+            '# HELP http_request_duration_seconds Request latency by route.',
+            '# TYPE http_request_duration_seconds histogram',
+        ]
+        for (method, route), histogram in sorted(self.latency.items()):
+            lines.extend(histogram.samples('http_request_duration_seconds', _labels(method=method, route=route)))
+        lines += [
+            '# HELP http_request_db_operations MongoDB commands issued per request.',
+            '# TYPE http_request_db_operations histogram',
+        ]
+        for (method, route), histogram in sorted(self.db_ops.items()):
+            lines.extend(histogram.samples('http_request_db_operations', _labels(method=method, route=route)))
+        lines += [
+            '# HELP http_request_db_seconds_total Time spent in MongoDB commands by route.',
+            '# TYPE http_request_db_seconds_total counter',
+        ]
+        for (method, route), seconds in sorted(self.db_seconds.items()):
+            lines.append(f'http_request_db_seconds_total{{{_labels(method=method, route=route)}}} {seconds}')
+        lines.extend(self.tracker.samples())
+        return "\n".join(lines) + "\n"
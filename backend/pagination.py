@@ -0,0 +1,144 @@
+"""Keyset pagination and NDJSON streaming for list endpoints.
+
+Lists are ordered newest first on ``(created_at, id)``. The cursor for the
+next page is an opaque token returned in the ``X-Next-Cursor`` header and
+passed back as ``after``.
+"""
+import base64
+import json
+from typing import Optional
+
+import orjson
+from fastapi import HTTPException, Query
+from fastapi.responses import ORJSONResponse, StreamingResponse
+
+MAX_PAGE_SIZE = 1000
+NEXT_CURSOR_HEADER = 'X-Next-Cursor'
+SORT = [("created_at", -1), ("id", -1)]
+
+
+class PageParams:
+    """Query parameters shared by the paginated list endpoints."""
+
+    def __init__(
+        self,
+        limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+        after: Optional[str] = None,
+        stream: bool = False
+    ):
+        self.limit = limit
+        self.after = after
+        self.stream = stream
+
+
+def encode_cursor(doc: dict) -> str:
+    raw = json.dumps([doc.get('created_at'), doc.get('id')], separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(token: str) -> tuple:
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        created_at, doc_id = json.loads(base64.urlsafe_b64decode(padded))
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return created_at, doc_id
+
+
+def after_query(query: dict, after: Optional[str]) -> dict:
+    if not after:
+        return query
+    created_at, doc_id = decode_cursor(after)
+    keyset = {"$or": [
+        {"created_at": {"$lt": created_at}},
+        {"created_at": created_at, "id": {"$lt": doc_id}},
+    ]}
+    return {"$and": [query, keyset]} if query else keyset
+
+
+def _sort_key(doc: dict) -> tuple:
+    return doc.get('created_at') or '', doc.get('id') or ''
+
+
+async def merge_sorted(*cursors, limit: Optional[int] = None):
+    """Merge cursors each sorted by :data:`SORT` into one sorted stream of at most ``limit`` docs."""
+    heads = [[cursor, await anext(cursor, None)] for cursor in cursors]
+    heads = [head for head in heads if head[1] is not None]
+    count = 0
+    while heads and (not limit or count < limit):
+        head = max(heads, key=lambda head: _sort_key(head[1]))
+        yield head[1]
+        count += 1
+        head[1] = await anext(head[0], None)
+        if head[1] is None:
+            heads.remove(head)
+
+
+async def _ndjson(cursor):
+    async for doc in cursor:
+        yield orjson.dumps(doc) + b'\n'
+
+
+def page_size(limit: Optional[int]) -> int:
+    return min(limit or MAX_PAGE_SIZE, MAX_PAGE_SIZE)
+
+
+def page_response(docs: list, limit: int) -> ORJSONResponse:
+    """Build the JSON page from up to ``limit + 1`` sorted documents."""
+    headers = {}
+    if len(docs) > limit:
+        docs = docs[:limit]
+        headers[NEXT_CURSOR_HEADER] = encode_cursor(docs[-1])
+    # Mongo documents go straight to orjson, skipping jsonable_encoder
+    return ORJSONResponse(content=docs, headers=headers)
+
+
+def ndjson_response(cursor) -> StreamingResponse:
+    return StreamingResponse(_ndjson(cursor), media_type='application/x-ndjson')
+
+
+async def paginate(
+    collection,
+    query: dict,
+    projection: dict,
+    limit: Optional[int] = None,
+    after: Optional[str] = None,
+    stream: bool = False
+):
+    """Return one page of ``collection`` matching ``query``.
+
+    JSON mode returns at most ``limit`` documents (default and cap
+    :data:`MAX_PAGE_SIZE`) with ``X-Next-Cursor`` set when more remain.
+    Stream mode yields NDJSON straight from the cursor and is only bounded
+    by ``limit`` when one is given.
+    """
+    cursor = collection.find(after_query(query, after), projection).sort(SORT)
+    if stream:
+        if limit:
+            cursor = cursor.limit(limit)
+        return ndjson_response(cursor.batch_size(200))
+
+    limit = page_size(limit)
+    docs = await cursor.limit(limit + 1).to_list(limit + 1)
+    return page_response(docs, limit)
+
+
+async def paginate_merged(
+    collections: list,
+    query: dict,
+    projection: dict,
+    limit: Optional[int] = None,
+    after: Optional[str] = None,
+    stream: bool = False
+):
+    """Like :func:`paginate`, over several collections holding disjoint documents."""
+    if not stream:
+        limit = page_size(limit) + 1
+    cursors = []
+    for collection in collections:
+        cursor = collection.find(after_query(query, after), projection).sort(SORT).batch_size(200)
+        cursors.append(cursor.limit(limit) if limit else cursor)
+    merged = merge_sorted(*cursors, limit=limit)
+    if stream:
+        return ndjson_response(merged)
+    return page_response([doc async for doc in merged], limit - 1)
@@ -0,0 +1,58 @@
+"""bcrypt hashing on a dedicated thread pool, off the event loop."""
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+import bcrypt
+
+
+class PasswordBusyError(Exception):
+    """Raised when too many hash/verify calls are already waiting."""
+
+
+class PasswordHasher:
+    """Runs bcrypt on a bounded pool of worker threads.
+
+    bcrypt releases the GIL while hashing, so threads give real parallelism.
+    At most ``workers`` calls run at once; once ``max_pending`` calls are in
+    flight, further calls fail fast with :class:`PasswordBusyError`.
+    """
+
+    def __init__(self, workers: int = 4, rounds: int = 12, max_pending: int = 256):
+        self.workers = workers
+        self.rounds = rounds
+        self.max_pending = max_pending
+        self.pending = 0
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='bcrypt')
+
+    async def _run(self, fn, *args):
+        if self.pending >= self.max_pending:
+            raise PasswordBusyError()
+        self.pending += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._pool, fn, *args)
+        finally:
+            self.pending -= 1
+
+    def _hash(self, password: str) -> str:
+        return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(self.rounds)).decode('utf-8')
+
+    @staticmethod
+    def _verify(password: str, hashed: str) -> bool:
+        return bcrypt.checkpw(password.encode('utf-8'), hashed.encode('utf-8'))
+
+    async def hash(self, password: str) -> str:
+        return await self._run(self._hash, password)
+
+    async def verify(self, password: str, hashed: str) -> bool:
+        return await self._run(self._verify, password, hashed)
+
+    def stats(self) -> dict:
+        return {
+            "workers": self.workers,
+            "rounds": self.rounds,
+            "in_flight": self.pending,
+            "queue_depth": max(0, self.pending - self.workers),
+        }
+
+    def shutdown(self) -> None:
+        self._pool.shutdown(wait=False, cancel_futures=True)
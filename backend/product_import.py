@@ -0,0 +1,172 @@
+"""Bulk product upserts for shop inventories.
+
+Rows arrive as a JSON array, NDJSON or CSV. NDJSON and CSV are parsed line by
+line straight off the request body or uploaded file, and written in chunks of
+unordered ``bulk_write`` upserts, so memory stays flat however large the
+file is; a line (or quoted CSV record) longer than ``MAX_LINE_BYTES`` stops
+the import there. A JSON array has to be parsed whole, so it is held in
+memory and capped at ``max_bytes``; larger imports should use NDJSON or CSV.
+A row matches an existing product of the shop by ``id`` when given,
+otherwise by name.
+"""
+import csv
+import json
+import uuid
+from datetime import datetime, timezone
+from typing import AsyncIterator, Optional
+
+from pydantic import BaseModel, Field, ValidationError
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
+CHUNK_SIZE = 1000
+MAX_REPORTED_ERRORS = 1000
+MAX_JSON_ARRAY_BYTES = 10 * 1024 * 1024
+MAX_LINE_BYTES = 1024 * 1024
+
+
+class ImportTooLargeError(Exception):
+    pass
+
+
+class ProductImport(BaseModel):
+    id: Optional[str] = None
+    name: str = Field(min_length=1)
+    description: str = ''
+    price: float = Field(ge=0)
+    category: str
+    image_url: Optional[str] = None
+    stock: int = Field(ge=0)
+    is_available: bool = True
+
+
+async def iter_lines(chunks: AsyncIterator[bytes], max_bytes: int = MAX_LINE_BYTES) -> AsyncIterator[str]:
+    buffer = b''
+    async for chunk in chunks:
+        buffer += chunk
+        *lines, buffer = buffer.split(b'\n')
+        for line in lines:
+            yield line.decode('utf-8-sig').rstrip('\r')
+        if len(buffer) > max_bytes:
+            raise ImportTooLargeError(f"Line longer than {max_bytes} bytes")
+    if buffer:
+        yield buffer.decode('utf-8-sig').rstrip('\r')
+
+
+async def ndjson_rows(chunks: AsyncIterator[bytes]) -> AsyncIterator[tuple]:
+    """Yield ``(row_number, row)``; undecodable lines come through as ``(n, None)``."""
+    number = 0
+    async for line in iter_lines(chunks):
+        if not line.strip():
+            continue
+        number += 1
+        try:
+            row = json.loads(line)
+        except ValueError:
+            row = None
+        yield number, row if isinstance(row, dict) else None
+
+
+async def csv_rows(chunks: AsyncIterator[bytes]) -> AsyncIterator[tuple]:
+    """Yield ``(row_number, row)`` keyed by the header row; blank cells are dropped."""
+    header, number = None, 0
+    parts, size, quotes = [], 0, 0
+    async for line in iter_lines(chunks):
+        parts.append(line)
+        size += len(line) + 1
+        quotes += line.count('"')
+        if size > MAX_LINE_BYTES:
+            raise ImportTooLargeError(f"Record longer than {MAX_LINE_BYTES} bytes")
+        if quotes % 2:
+            continue  # quoted field spans lines
+        record = '\n'.join(parts)
+        parts, size, quotes = [], 0, 0
+        if not record.strip():
+            continue
+        values = next(csv.reader([record]))
+        if header is None:
+            header = [name.strip() for name in values]
+            continue
+        number += 1
+        yield number, {key: value for key, value in zip(header, values) if value != ''}
+
+
+async def load_json_array(chunks: AsyncIterator[bytes], max_bytes: int = MAX_JSON_ARRAY_BYTES) -> list:
+    """Read and parse a whole JSON array body, giving up once it passes ``max_bytes``."""
+    body, size = [], 0
+    async for chunk in chunks:
+        size += len(chunk)
+        if size > max_bytes:
+            raise ImportTooLargeError(f"JSON array imports are limited to {max_bytes} bytes")
+        body.append(chunk)
+    rows = json.loads(b''.join(body))
+    if not isinstance(rows, list):
+        raise ValueError("Expected a JSON array of products")
+    return rows
+
+
+async def json_array_rows(rows: list) -> AsyncIterator[tuple]:
+    for number, row in enumerate(rows, start=1):
+        yield number, row if isinstance(row, dict) else None
+
+
+def _upsert(shop_id: str, product: ProductImport, now: str) -> UpdateOne:
+    # Only the columns the row gives overwrite an existing product; defaults
+    # (an empty description, available) apply to new products alone
+    fields = {**product.model_dump(exclude={'id'}, exclude_unset=True), "updated_at": now}
+    defaults = {key: value for key, value in product.model_dump(exclude={'id'}).items() if key not in fields}
+    if product.id:
+        match = {"shop_id": shop_id, "id": product.id}
+        on_insert = {**defaults, "created_at": now}
+    else:
+        match = {"shop_id": shop_id, "name": product.name}
+        on_insert = {**defaults, "id": str(uuid.uuid4()), "created_at": now}
+    return UpdateOne(match, {"$set": fields, "$setOnInsert": on_insert}, upsert=True)
+
+
+async def import_products(collection, shop_id: str, rows: AsyncIterator[tuple]) -> dict:
+    summary = {"received": 0, "inserted": 0, "updated": 0, "failed": 0, "errors": []}
+
+    def error(row_number: int, message: str):
+        summary['failed'] += 1
+        if len(summary['errors']) < MAX_REPORTED_ERRORS:
+            summary['errors'].append({"row": row_number, "error": message})
+
+    async def flush(products: list, row_numbers: list):
+        # Stamped per chunk, just before the write: a whole import stamped at
+        # its start could land behind a delta sync cursor that already passed
+        now = datetime.now(timezone.utc).isoformat()
+        ops = [_upsert(shop_id, product, now) for product in products]
+        try:
+            result = await collection.bulk_write(ops, ordered=False)
+            details = result.bulk_api_result
+        except BulkWriteError as e:
+            details = e.details
+            for write_error in details.get('writeErrors', []):
+                error(row_numbers[write_error['index']], write_error.get('errmsg', 'Write failed'))
+        summary['inserted'] += details.get('nUpserted', 0)
+        summary['updated'] += details.get('nMatched', 0)
+
+    products, row_numbers = [], []
+    try:
+        async for number, row in rows:
+            summary['received'] += 1
+            if row is None:
+                error(number, "Row is not a JSON object")
+                continue
+            try:
+                product = ProductImport(**row)
+            except ValidationError as e:
+                error(number, "; ".join(f"{'.'.join(map(str, err['loc']))}: {err['msg']}" for err in e.errors()))
+                continue
+            products.append(product)
+            row_numbers.append(number)
+            if len(products) >= CHUNK_SIZE:
+                await flush(products, row_numbers)
+                products, row_numbers = [], []
+    except ImportTooLargeError as e:
+        # Earlier chunks are already written; report where reading stopped
+        error(summary['received'] + 1, f"{e}; import stopped here")
+    if products:
+        await flush(products, row_numbers)
+    return summary
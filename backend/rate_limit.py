@@ -0,0 +1,192 @@
+"""Token-bucket rate limiting per user or client IP.
+
+Each rule allows ``burst`` requests at once, refilled at a steady rate.
+Authenticated requests are counted against the user in the JWT, anonymous
+ones against the client IP; login and registration always count against
+the IP. Buckets live in process memory by default, so each worker enforces
+its own share. :class:`MongoBucketStore` shares them across workers at the
+cost of one database round trip per request.
+"""
+import logging
+import math
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Dict, NamedTuple, Optional, Tuple
+
+import orjson
+from pymongo import ReturnDocument
+from pymongo.errors import PyMongoError
+
+logger = logging.getLogger(__name__)
+
+PERIODS = {"second": 1, "minute": 60, "hour": 3600}
+EXEMPT_PATHS = {"/api/health", "/api/ready", "/metrics"}
+
+
+class Limit(NamedTuple):
+    rate: float  # tokens per second
+    burst: int
+    by_ip: bool = False
+
+    @classmethod
+    def parse(cls, spec: str, by_ip: bool = False) -> "Limit":
+        """Parse ``"<count>/<second|minute|hour>[:<burst>]"``, e.g. ``"30/minute:10"``."""
+        rate, _, burst = spec.strip().partition(':')
+        count, _, period = rate.partition('/')
+        if period not in PERIODS:
+            raise ValueError(f"Invalid rate limit {spec!r}")
+        return cls(int(count) / PERIODS[period], int(burst or count), by_ip)
+
+
+class MemoryBucketStore:
+    """Buckets in a bounded LRU dict; the least recently seen clients are
+    forgotten first, which at worst hands them a fresh bucket."""
+
+    def __init__(self, maxsize: int = 100000):
+        self.maxsize = maxsize
+        self._buckets: "OrderedDict[str, tuple]" = OrderedDict()
+
+    async def take(self, key: str, limit: Limit) -> float:
+        """Spend one token; return 0 if allowed, else seconds until one is available."""
+        now = time.monotonic()
+        tokens, updated = self._buckets.get(key, (limit.burst, now))
+        tokens = min(limit.burst, tokens + (now - updated) * limit.rate)
+        wait = 0.0 if tokens >= 1 else (1 - tokens) / limit.rate
+        self._buckets[key] = (tokens - 1 if not wait else tokens, now)
+        self._buckets.move_to_end(key)
+        if len(self._buckets) > self.maxsize:
+            self._buckets.popitem(last=False)
+        return wait
+
+
+class MongoBucketStore:
+    """Buckets shared by every worker, refilled and spent in one atomic
+    pipeline update. Idle buckets are removed by a TTL index on ``expires_at``.
+
+    Fails open: if the database is unavailable the request is allowed.
+    """
+
+    def __init__(self, collection):
+        self.collection = collection
+
+    async def take(self, key: str, limit: Limit) -> float:
+        now = time.time()
+        refill_seconds = limit.burst / limit.rate
+        refilled = {"$min": [limit.burst, {"$add": [
+            {"$ifNull": ["$tokens", limit.burst]},
+            {"$multiply": [{"$subtract": [now, {"$ifNull": ["$updated", now]}]}, limit.rate]}
+        ]}]}
+        try:
+            bucket = await self.collection.find_one_and_update(
+                {"_id": key},
+                [
+                    {"$set": {"tokens": refilled, "updated": now}},
+                    {"$set": {"allowed": {"$gte": ["$tokens", 1]}}},
+                    {"$set": {
+                        "tokens": {"$cond": ["$allowed", {"$subtract": ["$tokens", 1]}, "$tokens"]},
+                        "expires_at": datetime.now(timezone.utc) + timedelta(seconds=refill_seconds),
+                    }},
+                ],
+                upsert=True,
+                return_document=ReturnDocument.AFTER
+            )
+        except PyMongoError as e:
+            logger.warning("Rate limit store unavailable, allowing request: %s", e)
+            return 0.0
+        return 0.0 if bucket["allowed"] else (1 - bucket["tokens"]) / limit.rate
+
+
+class RateLimiter:
+    def __init__(self, rules: Dict[Tuple[str, str], Limit], default: Optional[Limit], store=None):
+        self.rules = rules
+        self.default = default
+        self.store = store or MemoryBucketStore()
+        self.limited = 0
+
+    def limit_for(self, method: str, path: str) -> Tuple[str, Optional[Limit]]:
+        """Return the bucket prefix and limit for a request; routes with their
+        own rule get their own bucket, everything else shares the default."""
+        limit = self.rules.get((method, path))
+        if limit is not None:
+            return f"{method} {path}", limit
+        if path.startswith('/api/') and path not in EXEMPT_PATHS:
+            return "default", self.default
+        return "", None
+
+    def stats(self) -> dict:
+        return {"backend": type(self.store).__name__, "limited": self.limited}
+
+
+def _client_ip(scope, proxy_hops: int) -> str:
+    """The address ``proxy_hops`` entries from the right of ``X-Forwarded-For``.
+
+    Each trusted proxy appends the address it received the request from, so
+    entries further left were written by the client and cannot be trusted.
+    """
+    if proxy_hops:
+        forwarded = [
+            address.strip()
+            for name, value in scope['headers'] if name == b'x-forwarded-for'
+            for address in value.decode('latin-1').split(',')
+        ]
+        if len(forwarded) >= proxy_hops:
+            return forwarded[-proxy_hops]
+    client = scope.get('client')
+    return client[0] if client else 'unknown'
+
+
+def _bearer_token(scope) -> Optional[str]:
+    for name, value in scope['headers']:
+        if name == b'authorization':
+            scheme, _, token = value.decode('latin-1').partition(' ')
+            return token if scheme.lower() == 'bearer' else None
+    return None
+
+
+class RateLimitMiddleware:
+    """ASGI middleware answering 429 with ``Retry-After`` once a bucket is empty.
+
+    ``user_id`` maps a bearer token to its user id, or ``None`` if the
+    token is not valid, in which case the client IP is used instead.
+    ``proxy_hops`` is the number of trusted proxies in front of the app
+    that append to ``X-Forwarded-For``; with 0 the header is ignored.
+    """
+
+    def __init__(self, app, limiter: RateLimiter, user_id: Callable[[str], Optional[str]], proxy_hops: int = 0):
+        self.app = app
+        self.limiter = limiter
+        self.user_id = user_id
+        self.proxy_hops = proxy_hops
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+        bucket, limit = self.limiter.limit_for(scope['method'], scope['path'])
+        if limit is None:
+            return await self.app(scope, receive, send)
+
+        subject = None
+        if not limit.by_ip:
+            token = _bearer_token(scope)
+            user_id = self.user_id(token) if token else None
+            subject = f"user:{user_id}" if user_id else None
+        if subject is None:
+            subject = f"ip:{_client_ip(scope, self.proxy_hops)}"
+
+        wait = await self.limiter.store.take(f"{bucket}|{subject}", limit)
+        if not wait:
+            return await self.app(scope, receive, send)
+
+        self.limiter.limited += 1
+        body = orjson.dumps({"detail": "Too many requests, please retry later"})
+        await send({
+            "type": "http.response.start",
+            "status": 429,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode()),
+                (b"retry-after", str(math.ceil(wait)).encode()),
+            ],
+        })
+        await send({"type": "http.response.body", "body": body})
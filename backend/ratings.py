@@ -0,0 +1,112 @@
+"""Rating aggregates for shops and delivery agents.
+
+Each rated document keeps ``rating_sum`` and ``total_reviews`` alongside the
+derived ``rating`` average. A background job folds each new review into
+them in place; the aggregates can be rebuilt from the reviews collection with:
+
+    python ratings.py [--mongo-url URL] [--db-name NAME]
+"""
+import argparse
+import asyncio
+import os
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Optional
+
+from dotenv import load_dotenv
+from motor.motor_asyncio import AsyncIOMotorClient
+
+TARGET_COLLECTIONS = {"shop": "shops", "delivery_agent": "users"}
+
+
+async def apply_review(collection, target_id: str, rating: int, updated_at: Optional[str] = None, session=None):
+    """Fold one new review into the target's aggregates with a single atomic update.
+
+    Pass ``updated_at`` for targets that are delta-synced to clients.
+    """
+    # Documents from before rating_sum existed fall back to rating * total_reviews
+    touched = {"updated_at": updated_at} if updated_at else {}
+    return await collection.update_one(
+        {"id": target_id},
+        [
+            {"$set": {
+                **touched,
+                "rating_sum": {"$add": [
+                    {"$ifNull": ["$rating_sum", {"$multiply": [
+                        {"$ifNull": ["$rating", 0]}, {"$ifNull": ["$total_reviews", 0]}
+                    ]}]},
+                    rating
+                ]},
+                "total_reviews": {"$add": [{"$ifNull": ["$total_reviews", 0]}, 1]},
+            }},
+            {"$set": {"rating": {"$divide": ["$rating_sum", "$total_reviews"]}}},
+        ],
+        session=session
+    )
+
+
+async def apply_review_once(db, review_id: str, session=None) -> Optional[dict]:
+    """Apply a review to its target unless it is already marked ``rating_applied``.
+
+    Returns the review if it was applied now, else ``None``. Inside a
+    transaction a retry can never count a review twice; without one, a crash
+    between the update and the mark does, until the next rebuild.
+    """
+    review = await db.reviews.find_one(
+        {"id": review_id, "rating_applied": {"$ne": True}},
+        {"_id": 0, "target_id": 1, "target_type": 1, "rating": 1},
+        session=session
+    )
+    if review is None:
+        return None
+    # Shops are delta-synced, so the new rating has to move updated_at
+    updated_at = datetime.now(timezone.utc).isoformat() if review['target_type'] == 'shop' else None
+    await apply_review(
+        db[TARGET_COLLECTIONS[review['target_type']]], review['target_id'], review['rating'],
+        updated_at=updated_at, session=session
+    )
+    await db.reviews.update_one({"id": review_id}, {"$set": {"rating_applied": True}}, session=session)
+    return review
+
+
+async def rebuild_ratings(db) -> None:
+    """Recompute every aggregate from the reviews collection, server side.
+
+    Reviews are marked ``rating_applied`` first and only marked ones are
+    counted, so a review whose job is still queued is either counted here
+    (and the job skips it) or left to the job, never both.
+    """
+    await db.reviews.update_many({"rating_applied": {"$ne": True}}, {"$set": {"rating_applied": True}})
+    for target_type, collection in TARGET_COLLECTIONS.items():
+        await db.reviews.aggregate([
+            {"$match": {"target_type": target_type, "rating_applied": True}},
+            {"$group": {"_id": "$target_id", "rating_sum": {"$sum": "$rating"}, "total_reviews": {"$sum": 1}}},
+            {"$project": {
+                "_id": 0,
+                "id": "$_id",
+                "rating_sum": 1,
+                "total_reviews": 1,
+                "rating": {"$divide": ["$rating_sum", "$total_reviews"]},
+            }},
+            {"$merge": {"into": collection, "on": "id", "whenMatched": "merge", "whenNotMatched": "discard"}},
+        ]).to_list(None)
+
+
+async def main(mongo_url: str, db_name: str) -> None:
+    client = AsyncIOMotorClient(mongo_url)
+    try:
+        await rebuild_ratings(client[db_name])
+    finally:
+        client.close()
+    print("Ratings rebuilt")
+
+
+if __name__ == "__main__":
+    load_dotenv(Path(__file__).parent / '.env')
+    parser = argparse.ArgumentParser(description="Rebuild SamaanDena rating aggregates")
+    parser.add_argument("--mongo-url", default=os.environ.get('MONGO_URL'))
+    parser.add_argument("--db-name", default=os.environ.get('DB_NAME'))
+    args = parser.parse_args()
+    if not args.mongo_url or not args.db_name:
+        parser.error("MONGO_URL and DB_NAME must be set or passed as arguments")
+    asyncio.run(main(args.mongo_url, args.db_name))
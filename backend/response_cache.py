@@ -0,0 +1,164 @@
+"""Cached, compressed responses with ETag/Last-Modified for read-mostly routes.
+
+Responses are cached per URL and tagged with namespaces such as ``shops``.
+Write handlers call :meth:`ResponseCache.invalidate` on a namespace, which
+bumps its generation so older entries are never served again. Routes cached
+``per`` a parameter are also tagged ``namespace:value`` (``products:<shop
+id>``, say), so a write that only affects one shop invalidates just its
+entries. Each entry is
+compressed once (gzip, plus brotli when installed) and served to every
+client that accepts it. Invalidation is per process, so other workers may
+serve a stale entry until its TTL runs out.
+
+Catalogue reads may come from a lagging secondary, so for ``settle_seconds``
+after a namespace is invalidated its responses are served with
+``max-age=0`` and not stored; otherwise a read that missed the write would
+be cached for the full TTL.
+"""
+import functools
+import gzip
+import hashlib
+import time
+from collections import defaultdict
+from email.utils import formatdate, parsedate_to_datetime
+from typing import Optional
+
+import orjson
+from fastapi.responses import ORJSONResponse
+from starlette.responses import Response, StreamingResponse
+
+from cache import TTLCache
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover - brotli is optional
+    brotli = None
+
+MIN_COMPRESS_SIZE = 1000
+PASSTHROUGH_HEADERS = ('content-length', 'content-type', 'content-encoding', 'etag', 'last-modified', 'cache-control', 'vary')
+
+
+def compressed_response(request, content) -> Response:
+    """Serialize ``content`` once, compressed if the client accepts it; for uncacheable payloads."""
+    body = orjson.dumps(content)
+    accepted = request.headers.get('accept-encoding', '')
+    headers = {"Vary": "Accept-Encoding"}
+    if len(body) >= MIN_COMPRESS_SIZE:
+        if brotli is not None and 'br' in accepted:
+            body, headers["Content-Encoding"] = brotli.compress(body, quality=5), 'br'
+        elif 'gzip' in accepted:
+            body, headers["Content-Encoding"] = gzip.compress(body, compresslevel=6), 'gzip'
+    return Response(content=body, media_type="application/json", headers=headers)
+
+
+class ResponseCache:
+    def __init__(self, maxsize: int = 2048, settle_seconds: float = 5.0):
+        self._entries = TTLCache(maxsize=maxsize)
+        self._generations = defaultdict(int)
+        self._invalidated_at = {}
+        self.settle_seconds = settle_seconds
+
+    def invalidate(self, *namespaces: str) -> None:
+        now = time.monotonic()
+        for namespace in namespaces:
+            self._generations[namespace] += 1
+            self._invalidated_at[namespace] = now
+
+    def _settling(self, namespaces: tuple) -> bool:
+        since = time.monotonic() - self.settle_seconds
+        return any(self._invalidated_at.get(namespace, since) > since for namespace in namespaces)
+
+    def _build_entry(self, response: Response) -> dict:
+        body = response.body
+        digest = hashlib.sha256(body).hexdigest()[:32]
+        now = time.time()
+        entry = {
+            "body": body,
+            "media_type": response.media_type,
+            "headers": {k: v for k, v in response.headers.items() if k not in PASSTHROUGH_HEADERS},
+            "etag": f'"{digest}"',
+            "modified": int(now),
+            "last_modified": formatdate(now, usegmt=True),
+            "encoded": {},
+        }
+        if len(body) >= MIN_COMPRESS_SIZE:
+            entry["encoded"]["gzip"] = (gzip.compress(body, compresslevel=6), f'"{digest}-gz"')
+            if brotli is not None:
+                entry["encoded"]["br"] = (brotli.compress(body, quality=5), f'"{digest}-br"')
+        return entry
+
+    @staticmethod
+    def _not_modified(request, etag: str, modified: int) -> bool:
+        if_none_match = request.headers.get('if-none-match')
+        if if_none_match is not None:
+            tags = {tag.strip() for tag in if_none_match.split(',')}
+            return '*' in tags or etag in tags
+        if_modified_since = request.headers.get('if-modified-since')
+        if if_modified_since:
+            try:
+                return modified <= parsedate_to_datetime(if_modified_since).timestamp()
+            except (TypeError, ValueError):
+                return False
+        return False
+
+    def _serve(self, request, entry: dict, ttl: float) -> Response:
+        accepted = request.headers.get('accept-encoding', '')
+        body, etag, encoding = entry["body"], entry["etag"], None
+        for candidate in ('br', 'gzip'):
+            if candidate in entry["encoded"] and candidate in accepted:
+                (body, etag), encoding = entry["encoded"][candidate], candidate
+                break
+
+        headers = dict(entry["headers"])
+        headers.update({
+            "ETag": etag,
+            "Last-Modified": entry["last_modified"],
+            "Cache-Control": f"public, max-age={int(ttl)}",
+            "Vary": "Accept-Encoding",
+        })
+        if self._not_modified(request, etag, entry["modified"]):
+            return Response(status_code=304, headers=headers)
+        if encoding:
+            headers["Content-Encoding"] = encoding
+        return Response(content=body, media_type=entry["media_type"], headers=headers)
+
+    async def respond(self, request, namespaces: tuple, ttl: float, build) -> Response:
+        generations = tuple(self._generations[namespace] for namespace in namespaces)
+        key = (request.url.path, tuple(sorted(request.query_params.multi_items())), generations)
+        entry = self._entries.get(key)
+        if entry is None:
+            # Checked before the read, which is what may have missed the write
+            settling = self._settling(namespaces)
+            response = await build()
+            if isinstance(response, StreamingResponse):
+                return response
+            if not isinstance(response, Response):
+                response = ORJSONResponse(content=response)
+            if response.status_code != 200:
+                return response
+            entry = self._build_entry(response)
+            if settling:
+                return self._serve(request, entry, 0)
+            self._entries.set(key, entry, ttl)
+        return self._serve(request, entry, ttl)
+
+    def cached(self, *namespaces: str, ttl: float, per: Optional[str] = None):
+        """Decorate a GET endpoint that takes ``request: Request``.
+
+        With ``per``, a request carrying that path or query parameter is also
+        tagged ``namespace:value`` for each namespace.
+        """
+        def decorator(endpoint):
+            @functools.wraps(endpoint)
+            async def wrapper(*args, **kwargs):
+                request = kwargs['request']
+                tags = namespaces
+                value = per and (request.path_params.get(per) or request.query_params.get(per))
+                if value:
+                    tags += tuple(f"{namespace}:{value}" for namespace in namespaces)
+                return await self.respond(request, tags, ttl, lambda: endpoint(*args, **kwargs))
+            return wrapper
+        return decorator
+
+    def stats(self) -> dict:
+        return self._entries.stats()
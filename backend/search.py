@@ -0,0 +1,51 @@
+"""Ranked, faceted product search over the products text index."""
+from typing import List, Optional
+
+MAX_SEARCH_RESULTS = 100
+
+
+def search_pipeline(
+    q: Optional[str],
+    category: Optional[str] = None,
+    min_price: Optional[float] = None,
+    max_price: Optional[float] = None,
+    shop_ids: Optional[List[str]] = None,
+    offset: int = 0,
+    limit: int = 20
+) -> list:
+    """Build one aggregation returning ``results``, ``total`` and ``categories``.
+
+    The category facet ignores the ``category`` filter so clients can show
+    counts for the other categories alongside the filtered results.
+    """
+    match = {"is_available": True}
+    if q:
+        match["$text"] = {"$search": q}
+    if shop_ids is not None:
+        match["shop_id"] = {"$in": shop_ids}
+    price = {}
+    if min_price is not None:
+        price["$gte"] = min_price
+    if max_price is not None:
+        price["$lte"] = max_price
+    if price:
+        match["price"] = price
+
+    filtered = [{"$match": {"category": category}}] if category else []
+    sort = {"score": -1, "id": 1} if q else {"name": 1, "id": 1}
+    results = filtered + [{"$sort": sort}, {"$skip": offset}, {"$limit": limit}, {"$project": {"_id": 0}}]
+
+    pipeline = [{"$match": match}]
+    if q:
+        pipeline.append({"$addFields": {"score": {"$meta": "textScore"}}})
+    return pipeline + [
+        {"$facet": {
+            "results": results,
+            "total": filtered + [{"$count": "count"}],
+            "categories": [
+                {"$group": {"_id": "$category", "count": {"$sum": 1}}},
+                {"$sort": {"count": -1, "_id": 1}},
+                {"$project": {"_id": 0, "category": "$_id", "count": 1}},
+            ],
+        }},
+    ]
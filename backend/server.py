@@ -1,4 +1,5 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Depends, status
+from fastapi import FastAPI, APIRouter, HTTPException, Depends, Query, Request, status
+from fastapi.responses import ORJSONResponse, PlainTextResponse, StreamingResponse
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
@@ -10,22 +11,117 @@ from pydantic import BaseModel, Field, EmailStr, ConfigDict
 from typing import List, Optional, Literal
 import uuid
 from datetime import datetime, timezone, timedelta
+import asyncio
+from contextlib import asynccontextmanager
 import jwt
-import bcrypt
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import ConnectionFailure, DuplicateKeyError, PyMongoError
+
+from analytics import (
+    AGENT_STATS, ROLLUP_DELAY_SECONDS, SHOP_STATS, StatsRange,
+    order_rollups, refresh_hour, reporting_timezone, stats_series, top_products, with_average_delivery
+)
+from archive import ARCHIVE_COLLECTION, TERMINAL_STATUSES, run_periodically
+from assignment import ACTIVE_STATUSES, assign_pending
+from cache import TTLCache
+from database import (
+    ORDER_WRITE_CONCERN, REVIEW_WRITE_CONCERN, PoolTracker, catalogue_read_preference, client_options
+)
+from events import OrderEvents
+from indexes import create_indexes, indexes_current
+from jobs import JobQueue
+from loaders import MAX_BATCH_IDS, Loader, batch_result
+from metrics import Metrics, MetricsMiddleware
+from pagination import (
+    MAX_PAGE_SIZE, NEXT_CURSOR_HEADER, SORT, PageParams, after_query, merge_sorted, ndjson_response, page_response,
+    page_size, paginate, paginate_merged
+)
+from passwords import PasswordBusyError, PasswordHasher
+from product_import import (
+    MAX_JSON_ARRAY_BYTES, ImportTooLargeError, csv_rows, import_products, json_array_rows, load_json_array, ndjson_rows
+)
+from rate_limit import Limit, MongoBucketStore, RateLimiter, RateLimitMiddleware
+from ratings import apply_review_once
+from response_cache import ResponseCache, compressed_response
+from routing import plan_route
+from search import MAX_SEARCH_RESULTS, search_pipeline
+from sync import MAX_SYNC_ROWS, ORDER_FIELDS, PRODUCT_FIELDS, SHOP_FIELDS, SyncSource, sync_changes, sync_scope
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
-mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
-db = client[os.environ['DB_NAME']]
+# Per-route latency and DB usage; the client reports its commands to it
+metrics = Metrics(slow_ms=float(os.environ.get('SLOW_REQUEST_MS', 500)))
+
+pool_tracker = PoolTracker()
+
+# Opened by init_resources() in each worker once it has started, so nothing
+# connects at import time and no client or thread pool is shared across a fork
+client: Optional[AsyncIOMotorClient] = None
+db = catalogue_db = orders_db = reviews_db = None
+password_hasher: Optional[PasswordHasher] = None
 
-app = FastAPI()
 api_router = APIRouter(prefix="/api")
 security = HTTPBearer()
+optional_security = HTTPBearer(auto_error=False)
 
 JWT_SECRET = os.environ.get('JWT_SECRET', 'your-secret-key-change-in-production')
 JWT_ALGORITHM = 'HS256'
+READY_TIMEOUT = 2.0
+MAX_NEARBY_SHOPS = 200
+# JSON array imports are parsed in memory; NDJSON and CSV stream
+BULK_IMPORT_MAX_JSON_BYTES = int(os.environ.get('BULK_IMPORT_MAX_JSON_BYTES', MAX_JSON_ARRAY_BYTES))
+
+# Per-route limits; every other /api route shares the default bucket
+rate_limiter = RateLimiter(
+    rules={
+        ("POST", "/api/auth/login"): Limit.parse(os.environ.get('RATE_LIMIT_LOGIN', '20/minute'), by_ip=True),
+        ("POST", "/api/auth/register"): Limit.parse(os.environ.get('RATE_LIMIT_REGISTER', '10/minute'), by_ip=True),
+        ("POST", "/api/orders"): Limit.parse(os.environ.get('RATE_LIMIT_ORDERS', '30/minute:10')),
+        ("POST", "/api/products/bulk"): Limit.parse(os.environ.get('RATE_LIMIT_BULK_IMPORT', '30/hour:5')),
+    },
+    default=Limit.parse(os.environ.get('RATE_LIMIT_DEFAULT', '20/second:60'))
+)
+
+# Authenticated users by id, so most requests only need the JWT check
+user_cache = TTLCache(
+    maxsize=int(os.environ.get('USER_CACHE_SIZE', 10000)),
+    ttl=float(os.environ.get('USER_CACHE_TTL', 60))
+)
+
+order_events = OrderEvents()
+job_queue = JobQueue()
+
+# Public catalogue responses; write paths below invalidate by namespace
+response_cache = ResponseCache(
+    maxsize=int(os.environ.get('RESPONSE_CACHE_SIZE', 2048)),
+    settle_seconds=float(os.environ.get('RESPONSE_CACHE_SETTLE_S', 5))
+)
+
+def init_resources(mongo_url: Optional[str] = None, db_name: Optional[str] = None) -> None:
+    global client, db, catalogue_db, orders_db, reviews_db, password_hasher, _transactions_supported
+    client = AsyncIOMotorClient(
+        mongo_url or os.environ['MONGO_URL'], event_listeners=[metrics.tracker, pool_tracker], **client_options()
+    )
+    db = client[db_name or os.environ['DB_NAME']]
+    # Public catalogue reads tolerate replica lag; order writes must survive failover
+    catalogue_db = db.with_options(read_preference=catalogue_read_preference())
+    orders_db = db.with_options(write_concern=ORDER_WRITE_CONCERN)
+    reviews_db = db.with_options(write_concern=REVIEW_WRITE_CONCERN)
+    _transactions_supported = None
+    if os.environ.get('RATE_LIMIT_BACKEND', 'memory') == 'mongo':
+        rate_limiter.store = MongoBucketStore(db.rate_limits)
+    job_queue.collection = db.jobs
+    reporting_timezone()  # an unknown REPORTING_TIMEZONE fails here rather than on every order write
+    password_hasher = PasswordHasher(
+        workers=int(os.environ.get('BCRYPT_WORKERS', 4)),
+        rounds=int(os.environ.get('BCRYPT_ROUNDS', 12)),
+        max_pending=int(os.environ.get('BCRYPT_MAX_PENDING', 256))
+    )
+
+def close_resources() -> None:
+    client.close()
+    password_hasher.shutdown()
 
 # Models
 class UserRegister(BaseModel):
@@ -36,6 +132,11 @@ class UserRegister(BaseModel):
     role: Literal['customer', 'shop_owner', 'delivery_agent']
     location: Optional[dict] = None
 
+class LocationUpdate(BaseModel):
+    lat: float = Field(ge=-90, le=90)
+    lng: float = Field(ge=-180, le=180)
+    address: Optional[str] = None
+
 class UserLogin(BaseModel):
     email: EmailStr
     password: str
@@ -61,10 +162,12 @@ class Shop(BaseModel):
     location: dict
     address: str
     phone: str
+    geo: Optional[dict] = None
     rating: float = 0.0
     total_reviews: int = 0
     is_active: bool = True
     created_at: str
+    updated_at: Optional[str] = None
 
 class ShopCreate(BaseModel):
     name: str
@@ -85,6 +188,7 @@ class Product(BaseModel):
     stock: int
     is_available: bool = True
     created_at: str
+    updated_at: Optional[str] = None
 
 class ProductCreate(BaseModel):
     name: str
@@ -114,9 +218,13 @@ class Order(BaseModel):
     created_at: str
     updated_at: str
 
+class OrderItemCreate(BaseModel):
+    product_id: str
+    quantity: int = Field(gt=0)
+
 class OrderCreate(BaseModel):
     shop_id: str
-    items: List[OrderItem]
+    items: List[OrderItemCreate] = Field(min_length=1)
     delivery_address: str
     delivery_location: dict
 
@@ -136,12 +244,94 @@ class ReviewCreate(BaseModel):
     rating: int
     comment: str
 
+class BatchRequest(BaseModel):
+    shops: List[str] = Field(default_factory=list, max_length=MAX_BATCH_IDS)
+    products: List[str] = Field(default_factory=list, max_length=MAX_BATCH_IDS)
+    orders: List[str] = Field(default_factory=list, max_length=MAX_BATCH_IDS)
+    users: List[str] = Field(default_factory=list, max_length=MAX_BATCH_IDS)
+
 # Helper Functions
-def hash_password(password: str) -> str:
-    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
+async def hash_password(password: str) -> str:
+    try:
+        return await password_hasher.hash(password)
+    except PasswordBusyError:
+        raise HTTPException(status_code=503, detail="Server busy, please retry")
+
+async def verify_password(password: str, hashed: str) -> bool:
+    try:
+        return await password_hasher.verify(password, hashed)
+    except PasswordBusyError:
+        raise HTTPException(status_code=503, detail="Server busy, please retry")
+
+def location_coordinates(location: Optional[dict]) -> Optional[tuple]:
+    try:
+        return float(location['lng']), float(location['lat'])
+    except (TypeError, KeyError, ValueError):
+        return None
 
-def verify_password(password: str, hashed: str) -> bool:
-    return bcrypt.checkpw(password.encode('utf-8'), hashed.encode('utf-8'))
+def check_location(location: Optional[dict]) -> None:
+    # A 400 here rather than a write error from the 2dsphere index
+    coordinates = location_coordinates(location)
+    if coordinates and not (-180 <= coordinates[0] <= 180 and -90 <= coordinates[1] <= 90):
+        raise HTTPException(status_code=400, detail="Location lat must be within ±90 and lng within ±180")
+
+def to_geo_point(location: Optional[dict]) -> Optional[dict]:
+    # GeoJSON wants [longitude, latitude]. (0, 0) is what the app sends for an
+    # address typed in by hand, so such places are left out of geo searches
+    coordinates = location_coordinates(location)
+    if coordinates is None or coordinates == (0, 0):
+        return None
+    lng, lat = coordinates
+    if not (-180 <= lng <= 180 and -90 <= lat <= 90):
+        return None
+    return {"type": "Point", "coordinates": [lng, lat]}
+
+_transactions_supported: Optional[bool] = None
+
+async def transactions_supported() -> bool:
+    # Multi-document transactions need a replica set or a sharded cluster
+    global _transactions_supported
+    if _transactions_supported is None:
+        hello = await client.admin.command('hello')
+        _transactions_supported = 'setName' in hello or hello.get('msg') == 'isdbgrid'
+    return _transactions_supported
+
+async def release_stock(quantities: dict, session=None):
+    if quantities:
+        now = datetime.now(timezone.utc).isoformat()
+        await orders_db.products.bulk_write(
+            [
+                UpdateOne({"id": product_id}, {"$inc": {"stock": quantity}, "$set": {"updated_at": now}})
+                for product_id, quantity in quantities.items()
+            ],
+            ordered=False,
+            session=session
+        )
+
+async def reserve_stock(quantities: dict, session=None) -> bool:
+    # Each decrement only applies while enough stock is left, so concurrent
+    # checkouts can never oversell. Outside a transaction, partial
+    # reservations are handed back before reporting failure.
+    reserved = {}
+    now = datetime.now(timezone.utc).isoformat()
+    for product_id, quantity in quantities.items():
+        result = await orders_db.products.update_one(
+            {"id": product_id, "is_available": True, "stock": {"$gte": quantity}},
+            {"$inc": {"stock": -quantity}, "$set": {"updated_at": now}},
+            session=session
+        )
+        if result.modified_count == 0:
+            if session is None:
+                await release_stock(reserved)
+            return False
+        reserved[product_id] = quantity
+    return True
+
+def token_user_id(token: str) -> Optional[str]:
+    try:
+        return jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALGORITHM]).get('user_id')
+    except jwt.InvalidTokenError:
+        return None
 
 def create_token(user_id: str, role: str) -> str:
     payload = {
@@ -151,21 +341,38 @@ def create_token(user_id: str, role: str) -> str:
     }
     return jwt.encode(payload, JWT_SECRET, algorithm=JWT_ALGORITHM)
 
-async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
+async def authenticate(token: str) -> dict:
     try:
-        payload = jwt.decode(credentials.credentials, JWT_SECRET, algorithms=[JWT_ALGORITHM])
+        payload = jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALGORITHM])
         user_id = payload.get('user_id')
         if not user_id:
             raise HTTPException(status_code=401, detail="Invalid token")
-        user = await db.users.find_one({"id": user_id}, {"_id": 0})
-        if not user:
-            raise HTTPException(status_code=401, detail="User not found")
-        return user
+        user = user_cache.get(user_id)
+        if user is None:
+            user = await db.users.find_one({"id": user_id}, {"_id": 0, "password": 0})
+            if not user:
+                raise HTTPException(status_code=401, detail="User not found")
+            user_cache.set(user_id, user)
+        return dict(user)
     except jwt.ExpiredSignatureError:
         raise HTTPException(status_code=401, detail="Token expired")
     except jwt.InvalidTokenError:
         raise HTTPException(status_code=401, detail="Invalid token")
 
+async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
+    return await authenticate(credentials.credentials)
+
+async def get_stream_user(
+    token: Optional[str] = None,
+    credentials: Optional[HTTPAuthorizationCredentials] = Depends(optional_security)
+):
+    # EventSource cannot send headers, so the token may also come as ?token=
+    if credentials:
+        return await authenticate(credentials.credentials)
+    if token:
+        return await authenticate(token)
+    raise HTTPException(status_code=401, detail="Not authenticated")
+
 # Auth Routes
 @api_router.get("/")
 async def root():
@@ -173,6 +380,7 @@ async def root():
 
 @api_router.post("/auth/register")
 async def register(data: UserRegister):
+    check_location(data.location)
     existing = await db.users.find_one({"email": data.email}, {"_id": 0})
     if existing:
         raise HTTPException(status_code=400, detail="Email already registered")
@@ -187,9 +395,15 @@ async def register(data: UserRegister):
     )
     
     user_dict = user.model_dump()
-    user_dict['password'] = hash_password(data.password)
+    user_dict['password'] = await hash_password(data.password)
+    if data.role == 'delivery_agent':
+        user_dict['geo'] = to_geo_point(data.location)
     
-    await db.users.insert_one(user_dict)
+    try:
+        await db.users.insert_one(user_dict)
+    except DuplicateKeyError:
+        # A concurrent registration took the email after the check above
+        raise HTTPException(status_code=400, detail="Email already registered")
     token = create_token(user.id, user.role)
     
     return {"user": user.model_dump(), "token": token}
@@ -197,7 +411,7 @@ async def register(data: UserRegister):
 @api_router.post("/auth/login")
 async def login(data: UserLogin):
     user = await db.users.find_one({"email": data.email}, {"_id": 0})
-    if not user or not verify_password(data.password, user['password']):
+    if not user or not await verify_password(data.password, user['password']):
         raise HTTPException(status_code=401, detail="Invalid credentials")
     
     token = create_token(user['id'], user['role'])
@@ -210,12 +424,88 @@ async def get_me(current_user: dict = Depends(get_current_user)):
     current_user.pop('password', None)
     return current_user
 
+# Batch Routes
+PUBLIC_USER_PROJECTION = {"_id": 0, "id": 1, "name": 1, "role": 1, "rating": 1, "total_reviews": 1}
+
+class RequestLoaders:
+    """Loaders shared by everything one request resolves; built per request via ``Depends()``."""
+    
+    def __init__(self):
+        self.shops = Loader(catalogue_db.shops, {"_id": 0})
+        self.products = Loader(catalogue_db.products, {"_id": 0})
+        self.orders = Loader(db.orders, {"_id": 0}, fallback=db[ARCHIVE_COLLECTION])
+        self.users = Loader(db.users, PUBLIC_USER_PROJECTION)
+
+def batch_ids(ids: List[str] = Query(...)) -> List[str]:
+    # Accepts ?ids=a&ids=b as well as ?ids=a,b
+    ids = list(dict.fromkeys(part.strip() for value in ids for part in value.split(',') if part.strip()))
+    if len(ids) > MAX_BATCH_IDS:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_BATCH_IDS} ids per request")
+    return ids
+
+async def visible_orders(ids: List[str], user: dict, loaders: RequestLoaders) -> dict:
+    orders = await loaders.orders.load_many(ids)
+    if user['role'] == 'shop_owner':
+        shops = await loaders.shops.load_many({order['shop_id'] for order in orders.values()})
+        return {
+            order_id: order for order_id, order in orders.items()
+            if shops.get(order['shop_id'], {}).get('owner_id') == user['id']
+        }
+    field = 'delivery_agent_id' if user['role'] == 'delivery_agent' else 'customer_id'
+    return {order_id: order for order_id, order in orders.items() if order.get(field) == user['id']}
+
+@api_router.get("/shops/batch")
+@response_cache.cached("shops", ttl=60)
+async def get_shops_batch(request: Request, ids: List[str] = Depends(batch_ids), loaders: RequestLoaders = Depends()):
+    return batch_result(ids, await loaders.shops.load_many(ids))
+
+@api_router.get("/products/batch")
+@response_cache.cached("products", ttl=30)
+async def get_products_batch(request: Request, ids: List[str] = Depends(batch_ids), loaders: RequestLoaders = Depends()):
+    return batch_result(ids, await loaders.products.load_many(ids))
+
+@api_router.get("/orders/batch")
+async def get_orders_batch(
+    ids: List[str] = Depends(batch_ids),
+    loaders: RequestLoaders = Depends(),
+    current_user: dict = Depends(get_current_user)
+):
+    # Orders the caller may not see are reported as missing, like unknown ids
+    return batch_result(ids, await visible_orders(ids, current_user, loaders))
+
+@api_router.get("/users/batch")
+async def get_users_batch(
+    ids: List[str] = Depends(batch_ids),
+    loaders: RequestLoaders = Depends(),
+    current_user: dict = Depends(get_current_user)
+):
+    return batch_result(ids, await loaders.users.load_many(ids))
+
+@api_router.post("/batch")
+async def batch_get(data: BatchRequest, loaders: RequestLoaders = Depends(), current_user: dict = Depends(get_current_user)):
+    # One loader set for the whole request: shops fetched for the response are
+    # reused when authorizing orders instead of being queried again
+    shops, products, orders, users = await asyncio.gather(
+        loaders.shops.load_many(data.shops),
+        loaders.products.load_many(data.products),
+        visible_orders(data.orders, current_user, loaders),
+        loaders.users.load_many(data.users)
+    )
+    return {
+        "shops": batch_result(data.shops, shops),
+        "products": batch_result(data.products, products),
+        "orders": batch_result(data.orders, orders),
+        "users": batch_result(data.users, users),
+    }
+
 # Shop Routes
 @api_router.post("/shops", response_model=Shop)
 async def create_shop(data: ShopCreate, current_user: dict = Depends(get_current_user)):
     if current_user['role'] != 'shop_owner':
         raise HTTPException(status_code=403, detail="Only shop owners can create shops")
+    check_location(data.location)
     
+    now = datetime.now(timezone.utc).isoformat()
     shop = Shop(
         owner_id=current_user['id'],
         name=data.name,
@@ -223,30 +513,64 @@ async def create_shop(data: ShopCreate, current_user: dict = Depends(get_current
         location=data.location,
         address=data.address,
         phone=data.phone,
-        created_at=datetime.now(timezone.utc).isoformat()
+        geo=to_geo_point(data.location),
+        created_at=now,
+        updated_at=now
     )
     
     await db.shops.insert_one(shop.model_dump())
+    response_cache.invalidate("shops")
     return shop
 
 @api_router.get("/shops")
-async def get_shops(lat: Optional[float] = None, lng: Optional[float] = None):
-    shops = await db.shops.find({"is_active": True}, {"_id": 0}).to_list(1000)
-    return shops
+@response_cache.cached("shops", ttl=60)
+async def get_shops(
+    request: Request,
+    lat: Optional[float] = Query(None, ge=-90, le=90),
+    lng: Optional[float] = Query(None, ge=-180, le=180),
+    radius_km: Optional[float] = Query(None, gt=0),
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    after: Optional[str] = None,
+    stream: bool = False
+):
+    if lat is None or lng is None:
+        return await paginate(catalogue_db.shops, {"is_active": True}, {"_id": 0}, limit, after, stream)
+    
+    # Nearest-first results are one bounded page, not a cursor over all shops
+    if after is not None or stream:
+        raise HTTPException(status_code=400, detail="after and stream are not supported with lat/lng")
+    if limit is not None and limit > MAX_NEARBY_SHOPS:
+        raise HTTPException(status_code=400, detail=f"limit must be at most {MAX_NEARBY_SHOPS} with lat/lng")
+    limit = limit or 50
+    # Nearest-first lookup on the 2dsphere index; distance is reported in km
+    geo_near = {
+        "near": {"type": "Point", "coordinates": [lng, lat]},
+        "distanceField": "distance_km",
+        "distanceMultiplier": 0.001,
+        "key": "geo",
+        "query": {"is_active": True},
+        "spherical": True
+    }
+    if radius_km is not None:
+        geo_near["maxDistance"] = radius_km * 1000
+    
+    pipeline = [{"$geoNear": geo_near}, {"$limit": limit}, {"$project": {"_id": 0}}]
+    shops = await catalogue_db.shops.aggregate(pipeline).to_list(limit)
+    return ORJSONResponse(shops)
 
 @api_router.get("/shops/{shop_id}")
-async def get_shop(shop_id: str):
-    shop = await db.shops.find_one({"id": shop_id}, {"_id": 0})
+@response_cache.cached("shops", ttl=60)
+async def get_shop(shop_id: str, request: Request):
+    shop = await catalogue_db.shops.find_one({"id": shop_id}, {"_id": 0})
     if not shop:
         raise HTTPException(status_code=404, detail="Shop not found")
     return shop
 
 @api_router.get("/shops/owner/my-shops")
-async def get_my_shops(current_user: dict = Depends(get_current_user)):
+async def get_my_shops(page: PageParams = Depends(), current_user: dict = Depends(get_current_user)):
     if current_user['role'] != 'shop_owner':
         raise HTTPException(status_code=403, detail="Not authorized")
-    shops = await db.shops.find({"owner_id": current_user['id']}, {"_id": 0}).to_list(1000)
-    return shops
+    return await paginate(db.shops, {"owner_id": current_user['id']}, {"_id": 0}, **vars(page))
 
 # Product Routes
 @api_router.post("/products", response_model=Product)
@@ -258,6 +582,7 @@ async def create_product(data: ProductCreate, shop_id: str, current_user: dict =
     if not shop:
         raise HTTPException(status_code=404, detail="Shop not found or not authorized")
     
+    now = datetime.now(timezone.utc).isoformat()
     product = Product(
         shop_id=shop_id,
         name=data.name,
@@ -266,19 +591,113 @@ async def create_product(data: ProductCreate, shop_id: str, current_user: dict =
         category=data.category,
         image_url=data.image_url,
         stock=data.stock,
-        created_at=datetime.now(timezone.utc).isoformat()
+        created_at=now,
+        updated_at=now
     )
     
     await db.products.insert_one(product.model_dump())
+    response_cache.invalidate("products")
     return product
 
+@api_router.post("/products/bulk")
+async def bulk_import_products(shop_id: str, request: Request, current_user: dict = Depends(get_current_user)):
+    if current_user['role'] != 'shop_owner':
+        raise HTTPException(status_code=403, detail="Only shop owners can import products")
+    
+    shop = await db.shops.find_one({"id": shop_id, "owner_id": current_user['id']}, {"_id": 0, "id": 1})
+    if not shop:
+        raise HTTPException(status_code=404, detail="Shop not found or not authorized")
+    
+    # Either a raw body or a multipart upload in a "file" field
+    content_type = request.headers.get('content-type', '').split(';')[0].strip().lower()
+    chunks = request.stream()
+    if content_type == 'multipart/form-data':
+        form = await request.form()
+        upload = form.get('file')
+        if upload is None or not hasattr(upload, 'read'):
+            raise HTTPException(status_code=400, detail="Expected a file field")
+        filename = (upload.filename or '').lower()
+        content_type = {'.csv': 'text/csv', '.ndjson': 'application/x-ndjson', '.jsonl': 'application/x-ndjson',
+                        '.json': 'application/json'}.get(Path(filename).suffix, upload.content_type)
+        
+        async def read_upload():
+            while chunk := await upload.read(64 * 1024):
+                yield chunk
+        chunks = read_upload()
+    
+    if content_type == 'text/csv':
+        rows = csv_rows(chunks)
+    elif content_type in ('application/x-ndjson', 'application/jsonl'):
+        rows = ndjson_rows(chunks)
+    elif content_type == 'application/json':
+        try:
+            rows = json_array_rows(await load_json_array(chunks, BULK_IMPORT_MAX_JSON_BYTES))
+        except ImportTooLargeError as e:
+            raise HTTPException(status_code=413, detail=f"{e}; send NDJSON or CSV for larger imports")
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=f"Invalid JSON: {e}")
+    else:
+        raise HTTPException(status_code=415, detail="Send JSON, NDJSON or CSV")
+    
+    summary = await import_products(db.products, shop_id, rows)
+    response_cache.invalidate("products")
+    return summary
+
 @api_router.get("/products")
-async def get_products(shop_id: Optional[str] = None):
+@response_cache.cached("products", ttl=30, per="shop_id")
+async def get_products(request: Request, shop_id: Optional[str] = None, page: PageParams = Depends()):
     query = {"is_available": True}
     if shop_id:
         query["shop_id"] = shop_id
-    products = await db.products.find(query, {"_id": 0}).to_list(1000)
-    return products
+    return await paginate(catalogue_db.products, query, {"_id": 0}, **vars(page))
+
+@api_router.get("/products/search")
+@response_cache.cached("products", "shops", ttl=30)
+async def search_products(
+    request: Request,
+    q: Optional[str] = Query(None, max_length=100),
+    category: Optional[str] = None,
+    min_price: Optional[float] = Query(None, ge=0),
+    max_price: Optional[float] = Query(None, ge=0),
+    lat: Optional[float] = Query(None, ge=-90, le=90),
+    lng: Optional[float] = Query(None, ge=-180, le=180),
+    radius_km: float = Query(10, gt=0, le=100),
+    offset: int = Query(0, ge=0),
+    limit: int = Query(20, ge=1, le=MAX_SEARCH_RESULTS)
+):
+    shop_distances = None
+    if lat is not None and lng is not None:
+        # Nearby shops come off the 2dsphere index; products are then searched within them
+        shops = await catalogue_db.shops.aggregate([
+            {"$geoNear": {
+                "near": {"type": "Point", "coordinates": [lng, lat]},
+                "distanceField": "distance_km",
+                "distanceMultiplier": 0.001,
+                "maxDistance": radius_km * 1000,
+                "key": "geo",
+                "query": {"is_active": True},
+                "spherical": True
+            }},
+            {"$project": {"_id": 0, "id": 1, "distance_km": 1}}
+        ]).to_list(None)
+        shop_distances = {shop['id']: shop['distance_km'] for shop in shops}
+    
+    pipeline = search_pipeline(
+        q.strip() if q else None, category, min_price, max_price,
+        list(shop_distances) if shop_distances is not None else None, offset, limit
+    )
+    facets = (await catalogue_db.products.aggregate(pipeline).to_list(1))[0]
+    results = facets['results']
+    if shop_distances is not None:
+        for product in results:
+            product['distance_km'] = shop_distances.get(product['shop_id'])
+    return {
+        "results": results,
+        "total": facets['total'][0]['count'] if facets['total'] else 0,
+        "categories": facets['categories'],
+        "offset": offset,
+        "limit": limit
+    }
 
 @api_router.put("/products/{product_id}")
 async def update_product(product_id: str, data: ProductCreate, current_user: dict = Depends(get_current_user)):
@@ -293,7 +712,10 @@ async def update_product(product_id: str, data: ProductCreate, current_user: dic
     if not shop:
         raise HTTPException(status_code=403, detail="Not authorized")
     
-    await db.products.update_one({"id": product_id}, {"$set": data.model_dump()})
+    await db.products.update_one(
+        {"id": product_id}, {"$set": {**data.model_dump(), "updated_at": datetime.now(timezone.utc).isoformat()}}
+    )
+    response_cache.invalidate("products")
     return {"message": "Product updated successfully"}
 
 # Order Routes
@@ -302,12 +724,33 @@ async def create_order(data: OrderCreate, current_user: dict = Depends(get_curre
     if current_user['role'] != 'customer':
         raise HTTPException(status_code=403, detail="Only customers can place orders")
     
-    total = sum(item.price * item.quantity for item in data.items)
+    quantities = {}
+    for item in data.items:
+        quantities[item.product_id] = quantities.get(item.product_id, 0) + item.quantity
+    
+    products = await db.products.find(
+        {"id": {"$in": list(quantities)}, "shop_id": data.shop_id, "is_available": True},
+        {"_id": 0, "id": 1, "name": 1, "price": 1}
+    ).to_list(len(quantities))
+    if len(products) != len(quantities):
+        raise HTTPException(status_code=400, detail="Some products are not available at this shop")
+    
+    products_by_id = {product['id']: product for product in products}
+    items = [
+        OrderItem(
+            product_id=product_id,
+            product_name=products_by_id[product_id]['name'],
+            quantity=quantity,
+            price=products_by_id[product_id]['price']
+        )
+        for product_id, quantity in quantities.items()
+    ]
+    total = sum(item.price * item.quantity for item in items)
     
     order = Order(
         customer_id=current_user['id'],
         shop_id=data.shop_id,
-        items=[item.model_dump() for item in data.items],
+        items=items,
         total_amount=total,
         delivery_address=data.delivery_address,
         delivery_location=data.delivery_location,
@@ -315,27 +758,109 @@ async def create_order(data: OrderCreate, current_user: dict = Depends(get_curre
         updated_at=datetime.now(timezone.utc).isoformat()
     )
     
-    await db.orders.insert_one(order.model_dump())
+    if await transactions_supported():
+        async def place_order(session):
+            if not await reserve_stock(quantities, session):
+                raise HTTPException(status_code=409, detail="Insufficient stock")
+            await orders_db.orders.insert_one(order.model_dump(), session=session)
+        
+        async with await client.start_session() as session:
+            await session.with_transaction(place_order, write_concern=ORDER_WRITE_CONCERN)
+    else:
+        if not await reserve_stock(quantities):
+            raise HTTPException(status_code=409, detail="Insufficient stock")
+        try:
+            await orders_db.orders.insert_one(order.model_dump())
+        except Exception:
+            await release_stock(quantities)
+            raise
+    
+    # After the commit, so the shop's listing rebuilt straight away sees the
+    # new stock. Only that shop's: other product responses keep their short
+    # TTL, since checkout re-checks stock anyway and invalidating the whole
+    # namespace on every order would leave nothing cached under load.
+    response_cache.invalidate(f"products:{data.shop_id}")
+    await order_written(order.id, order.model_dump(), order_rollups(order.model_dump(), placed=True))
     return order
 
+def owner_orders_pipeline(owner_id: str, order_query: dict, limit: Optional[int], source: str = "orders") -> list:
+    # Starts from the owner's shops and pulls at most `limit` orders per shop
+    # off the (shop_id, created_at, id) index, so the merged page is exact
+    # without scanning every order of every shop.
+    orders_pipeline = [{"$match": {"$and": [{"$expr": {"$eq": ["$shop_id", "$$shop_id"]}}, order_query]}}, {"$sort": dict(SORT)}]
+    if limit:
+        orders_pipeline.append({"$limit": limit})
+    orders_pipeline.append({"$project": {"_id": 0}})
+    
+    pipeline = [
+        {"$match": {"owner_id": owner_id}},
+        {"$lookup": {"from": source, "let": {"shop_id": "$id"}, "pipeline": orders_pipeline, "as": "order"}},
+        {"$unwind": "$order"},
+        {"$replaceRoot": {"newRoot": {"$mergeObjects": ["$order", {"shop_name": "$name"}]}}},
+        {"$sort": dict(SORT)},
+    ]
+    if limit:
+        pipeline.append({"$limit": limit})
+    
+    for field, prefix, projection in (
+        ("customer_id", "customer", {"_id": 0, "name": 1, "phone": 1}),
+        ("delivery_agent_id", "delivery_agent", {"_id": 0, "name": 1, "phone": 1}),
+    ):
+        pipeline += [
+            {"$lookup": {
+                "from": "users",
+                "let": {"user_id": f"${field}"},
+                "pipeline": [{"$match": {"$expr": {"$eq": ["$id", "$$user_id"]}}}, {"$project": projection}],
+                "as": prefix
+            }},
+            {"$set": {
+                f"{prefix}_name": {"$arrayElemAt": [f"${prefix}.name", 0]},
+                f"{prefix}_phone": {"$arrayElemAt": [f"${prefix}.phone", 0]}
+            }},
+            {"$unset": prefix},
+        ]
+    return pipeline
+
 @api_router.get("/orders")
-async def get_orders(current_user: dict = Depends(get_current_user)):
+async def get_orders(
+    status: Optional[List[str]] = Query(None),
+    include_archived: bool = False,
+    page: PageParams = Depends(),
+    current_user: dict = Depends(get_current_user)
+):
     query = {}
+    if status:
+        query['status'] = {"$in": status}
+    sources = ["orders", ARCHIVE_COLLECTION] if include_archived else ["orders"]
+    
+    if current_user['role'] == 'shop_owner':
+        # One round trip per source: orders across all owned shops, joined
+        # with shop, customer and agent details
+        order_query = after_query(query, page.after)
+        limit = page.limit if page.stream else page_size(page.limit) + 1
+        cursors = [
+            db.shops.aggregate(owner_orders_pipeline(current_user['id'], order_query, limit, source))
+            for source in sources
+        ]
+        if page.stream:
+            return ndjson_response(merge_sorted(*cursors, limit=limit))
+        orders = [order async for order in merge_sorted(*cursors, limit=limit)]
+        return page_response(orders, limit - 1)
+    
     if current_user['role'] == 'customer':
         query['customer_id'] = current_user['id']
-    elif current_user['role'] == 'shop_owner':
-        shops = await db.shops.find({"owner_id": current_user['id']}, {"_id": 0}).to_list(1000)
-        shop_ids = [shop['id'] for shop in shops]
-        query['shop_id'] = {"$in": shop_ids}
     elif current_user['role'] == 'delivery_agent':
         query['delivery_agent_id'] = current_user['id']
     
-    orders = await db.orders.find(query, {"_id": 0}).sort("created_at", -1).to_list(1000)
-    return orders
+    if include_archived:
+        return await paginate_merged([db.orders, db[ARCHIVE_COLLECTION]], query, {"_id": 0}, **vars(page))
+    return await paginate(db.orders, query, {"_id": 0}, **vars(page))
 
 @api_router.get("/orders/{order_id}")
 async def get_order(order_id: str, current_user: dict = Depends(get_current_user)):
     order = await db.orders.find_one({"id": order_id}, {"_id": 0})
+    if not order:
+        order = await db[ARCHIVE_COLLECTION].find_one({"id": order_id}, {"_id": 0})
     if not order:
         raise HTTPException(status_code=404, detail="Order not found")
     
@@ -353,42 +878,144 @@ async def update_order_status(order_id: str, status: str, current_user: dict = D
     if current_user['role'] == 'delivery_agent' and order.get('delivery_agent_id') != current_user['id']:
         raise HTTPException(status_code=403, detail="Not authorized")
     
-    await db.orders.update_one(
+    now = datetime.now(timezone.utc)
+    update = {"$set": {"status": status, "updated_at": now.isoformat()}}
+    if status in TERMINAL_STATUSES:
+        # A real date, so the archival job can range-query it
+        update["$set"]["completed_at"] = now
+    else:
+        update["$unset"] = {"completed_at": ""}
+    updated = await orders_db.orders.find_one_and_update(
         {"id": order_id},
-        {"$set": {"status": status, "updated_at": datetime.now(timezone.utc).isoformat()}}
+        update,
+        projection={"_id": 0},
+        return_document=ReturnDocument.AFTER
     )
+    # Both the hour it was completed in before and the one it is completed in now
+    await order_written(order_id, updated, order_rollups(order) + order_rollups(updated))
     return {"message": "Order status updated"}
 
-@api_router.put("/orders/{order_id}/assign")
-async def assign_delivery_agent(order_id: str, agent_id: str, current_user: dict = Depends(get_current_user)):
-    if current_user['role'] != 'shop_owner':
-        raise HTTPException(status_code=403, detail="Only shop owners can assign delivery agents")
-    
+async def owned_order(order_id: str, owner_id: str) -> dict:
     order = await db.orders.find_one({"id": order_id}, {"_id": 0})
     if not order:
         raise HTTPException(status_code=404, detail="Order not found")
     
-    shop = await db.shops.find_one({"id": order['shop_id'], "owner_id": current_user['id']}, {"_id": 0})
+    shop = await db.shops.find_one({"id": order['shop_id'], "owner_id": owner_id}, {"_id": 0, "id": 1})
     if not shop:
         raise HTTPException(status_code=403, detail="Not authorized")
+    return order
+
+@api_router.put("/orders/{order_id}/assign")
+async def assign_delivery_agent(order_id: str, agent_id: str, current_user: dict = Depends(get_current_user)):
+    if current_user['role'] != 'shop_owner':
+        raise HTTPException(status_code=403, detail="Only shop owners can assign delivery agents")
+    
+    await owned_order(order_id, current_user['id'])
     
     agent = await db.users.find_one({"id": agent_id, "role": "delivery_agent"}, {"_id": 0})
     if not agent:
         raise HTTPException(status_code=404, detail="Delivery agent not found")
     
-    await db.orders.update_one(
+    updated = await orders_db.orders.find_one_and_update(
         {"id": order_id},
-        {"$set": {"delivery_agent_id": agent_id, "status": "assigned", "updated_at": datetime.now(timezone.utc).isoformat()}}
+        {"$set": {"delivery_agent_id": agent_id, "status": "assigned", "updated_at": datetime.now(timezone.utc).isoformat()}},
+        projection={"_id": 0},
+        return_document=ReturnDocument.AFTER
     )
+    await order_events.notify(db, updated)
     return {"message": "Delivery agent assigned"}
 
+@api_router.get("/events/orders")
+async def order_event_stream(
+    request: Request,
+    order_id: Optional[str] = None,
+    current_user: dict = Depends(get_stream_user)
+):
+    return StreamingResponse(
+        order_events.stream(request, current_user['id'], order_id),
+        media_type='text/event-stream',
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@api_router.post("/orders/auto-assign")
+async def auto_assign_orders(limit: int = Query(100, ge=1, le=1000), current_user: dict = Depends(get_current_user)):
+    if current_user['role'] != 'shop_owner':
+        raise HTTPException(status_code=403, detail="Only shop owners can assign delivery agents")
+    
+    shops = await db.shops.find({"owner_id": current_user['id']}, {"_id": 0, "id": 1}).to_list(None)
+    pending = await db.orders.find(
+        {"shop_id": {"$in": [shop['id'] for shop in shops]}, "status": "pending", "delivery_agent_id": None},
+        {"_id": 0}
+    ).sort("created_at", 1).to_list(limit)
+    
+    assigned = await assign_pending(orders_db, pending)
+    for order in assigned:
+        await order_events.notify(db, order)
+    assigned_ids = {order['id'] for order in assigned}
+    return {
+        "assigned": [{"order_id": order['id'], "agent_id": order['delivery_agent_id']} for order in assigned],
+        "unassigned": [order['id'] for order in pending if order['id'] not in assigned_ids]
+    }
+
+@api_router.post("/orders/{order_id}/auto-assign")
+async def auto_assign_order(order_id: str, current_user: dict = Depends(get_current_user)):
+    if current_user['role'] != 'shop_owner':
+        raise HTTPException(status_code=403, detail="Only shop owners can assign delivery agents")
+    
+    order = await owned_order(order_id, current_user['id'])
+    if order['status'] != 'pending' or order.get('delivery_agent_id'):
+        raise HTTPException(status_code=409, detail="Order is already assigned")
+    
+    assigned = await assign_pending(orders_db, [order])
+    if not assigned:
+        raise HTTPException(status_code=404, detail="No delivery agent available nearby")
+    await order_events.notify(db, assigned[0])
+    return {"message": "Delivery agent assigned", "agent_id": assigned[0]['delivery_agent_id']}
+
 # Delivery Agent Routes
+@api_router.put("/delivery-agents/me/location")
+async def update_agent_location(data: LocationUpdate, current_user: dict = Depends(get_current_user)):
+    if current_user['role'] != 'delivery_agent':
+        raise HTTPException(status_code=403, detail="Not authorized")
+    
+    location = data.model_dump(exclude_none=True)
+    await db.users.update_one(
+        {"id": current_user['id']},
+        {"$set": {"location": location, "geo": to_geo_point(location)}}
+    )
+    user_cache.invalidate(current_user['id'])
+    return {"message": "Location updated"}
+
+@api_router.get("/delivery-agents/me/route")
+async def get_agent_route(
+    lat: Optional[float] = Query(None, ge=-90, le=90),
+    lng: Optional[float] = Query(None, ge=-180, le=180),
+    current_user: dict = Depends(get_current_user)
+):
+    """Suggested stop order for the agent's active orders, starting from
+    ``lat``/``lng`` if given, else the agent's last reported location."""
+    if current_user['role'] != 'delivery_agent':
+        raise HTTPException(status_code=403, detail="Not authorized")
+    
+    orders = await orders_db.orders.find(
+        {"delivery_agent_id": current_user['id'], "status": {"$in": ACTIVE_STATUSES}},
+        {"_id": 0, "id": 1, "shop_id": 1, "status": 1, "delivery_address": 1, "delivery_location": 1}
+    ).sort("created_at", 1).to_list(None)
+    shop_ids = list({order['shop_id'] for order in orders if order['status'] != 'picked_up'})
+    shop_points = {}
+    async for shop in catalogue_db.shops.find({"id": {"$in": shop_ids}}, {"_id": 0, "id": 1, "location": 1}):
+        point = to_geo_point(shop.get('location'))
+        if point:
+            shop_points[shop['id']] = point['coordinates']
+    
+    start = to_geo_point({"lat": lat, "lng": lng} if lat is not None and lng is not None else current_user.get('location'))
+    return plan_route(start['coordinates'] if start else None, orders, shop_points)
+
 @api_router.get("/delivery-agents")
-async def get_delivery_agents(current_user: dict = Depends(get_current_user)):
+async def get_delivery_agents(page: PageParams = Depends(), current_user: dict = Depends(get_current_user)):
     if current_user['role'] != 'shop_owner':
         raise HTTPException(status_code=403, detail="Not authorized")
-    agents = await db.users.find({"role": "delivery_agent"}, {"_id": 0, "password": 0}).to_list(1000)
-    return agents
+    return await paginate(db.users, {"role": "delivery_agent"}, {"_id": 0, "password": 0}, **vars(page))
 
 # Review Routes
 @api_router.post("/reviews", response_model=Review)
@@ -405,38 +1032,161 @@ async def create_review(data: ReviewCreate, current_user: dict = Depends(get_cur
         created_at=datetime.now(timezone.utc).isoformat()
     )
     
-    await db.reviews.insert_one(review.model_dump())
+    await reviews_db.reviews.insert_one(review.model_dump())
+    response_cache.invalidate("reviews")
     
-    # Update rating
-    collection = db.shops if data.target_type == 'shop' else db.users
-    reviews = await db.reviews.find({"target_id": data.target_id}, {"_id": 0}).to_list(1000)
-    avg_rating = sum(r['rating'] for r in reviews) / len(reviews)
-    
-    await collection.update_one(
-        {"id": data.target_id},
-        {"$set": {"rating": avg_rating, "total_reviews": len(reviews)}}
-    )
+    # The review is saved; failing the request now would only invite a duplicate
+    try:
+        await job_queue.enqueue("apply_review", {"review_id": review.id})
+    except PyMongoError:
+        logger.exception("Rating update for review %s not queued; `python ratings.py` will count it", review.id)
     
     return review
 
+@job_queue.handler("apply_review")
+async def apply_review_job(payload: dict):
+    if await transactions_supported():
+        async def apply(session):
+            return await apply_review_once(reviews_db, payload['review_id'], session)
+        
+        async with await client.start_session() as session:
+            review = await session.with_transaction(apply)
+    else:
+        review = await apply_review_once(reviews_db, payload['review_id'])
+    if review is None:
+        return
+    if review['target_type'] == 'shop':
+        response_cache.invalidate("shops")
+    else:
+        user_cache.invalidate(review['target_id'])
+
 @api_router.get("/reviews/{target_id}")
-async def get_reviews(target_id: str):
-    reviews = await db.reviews.find({"target_id": target_id}, {"_id": 0}).to_list(1000)
-    return reviews
+@response_cache.cached("reviews", ttl=120)
+async def get_reviews(target_id: str, request: Request, page: PageParams = Depends()):
+    return await paginate(catalogue_db.reviews, {"target_id": target_id}, {"_id": 0, "rating_applied": 0}, **vars(page))
+
+# Analytics
+async def enqueue_rollups(pairs: list):
+    for scope, hour in pairs:
+        (scope_key, scope_value), = scope.items()
+        # Delayed so that a busy hour is recomputed once rather than per order
+        await job_queue.enqueue(
+            "refresh_rollups", {"scope": scope, "hour": hour},
+            key=f"refresh_rollups:{scope_key}:{scope_value}:{hour}", delay=ROLLUP_DELAY_SECONDS
+        )
+
+async def order_written(order_id: str, order: Optional[dict], rollups: list):
+    # The write is committed by now: an error here must not fail the request,
+    # or the client retries a checkout that already went through
+    try:
+        await order_events.notify(db, order)
+    except PyMongoError:
+        logger.exception("Could not publish event for order %s", order_id)
+    try:
+        await enqueue_rollups(rollups)
+    except PyMongoError:
+        logger.exception("Rollups for order %s not queued; `python analytics.py` rebuilds them", order_id)
+
+@job_queue.handler("refresh_rollups")
+async def refresh_rollups_job(payload: dict):
+    await refresh_hour(db, payload['scope'], payload['hour'])
+
+async def owned_shop(shop_id: str, current_user: dict) -> dict:
+    if current_user['role'] != 'shop_owner':
+        raise HTTPException(status_code=403, detail="Not authorized")
+    shop = await db.shops.find_one({"id": shop_id, "owner_id": current_user['id']}, {"_id": 0, "id": 1})
+    if not shop:
+        raise HTTPException(status_code=403, detail="Not authorized")
+    return shop
+
+@api_router.get("/analytics/shops/{shop_id}")
+async def get_shop_stats(shop_id: str, window: StatsRange = Depends(), current_user: dict = Depends(get_current_user)):
+    await owned_shop(shop_id, current_user)
+    return await stats_series(db.shop_stats, SHOP_STATS, {"shop_id": shop_id}, window)
+
+@api_router.get("/analytics/shops/{shop_id}/products")
+async def get_product_stats(
+    shop_id: str,
+    window: StatsRange = Depends(),
+    limit: int = Query(20, ge=1, le=100),
+    current_user: dict = Depends(get_current_user)
+):
+    await owned_shop(shop_id, current_user)
+    return {
+        "period": window.period, "start": window.first, "end": window.last,
+        "products": await top_products(db.product_stats, shop_id, window, limit)
+    }
+
+@api_router.get("/analytics/agents/me")
+async def get_agent_stats(window: StatsRange = Depends(), current_user: dict = Depends(get_current_user)):
+    if current_user['role'] != 'delivery_agent':
+        raise HTTPException(status_code=403, detail="Not authorized")
+    
+    stats = await stats_series(db.agent_stats, AGENT_STATS, {"agent_id": current_user['id']}, window)
+    for row in stats['series'] + [stats['totals']]:
+        with_average_delivery(row)
+    return stats
+
+# Delta sync
+@api_router.get("/sync")
+async def sync(
+    request: Request,
+    token: Optional[str] = None,
+    shop_id: Optional[List[str]] = Query(None),
+    limit: int = Query(MAX_SYNC_ROWS, ge=1, le=MAX_SYNC_ROWS),
+    credentials: Optional[HTTPAuthorizationCredentials] = Depends(optional_security)
+):
+    # Reads stay on the primary: a lagging secondary could move the token
+    # past writes it has not replicated yet
+    current_user = await authenticate(credentials.credentials) if credentials else None
+    sources = [
+        SyncSource("shops", db.shops, {}, SHOP_FIELDS, live_flag="is_active"),
+        SyncSource("products", db.products, {"shop_id": {"$in": shop_id}} if shop_id else {}, PRODUCT_FIELDS, live_flag="is_available"),
+    ]
+    if current_user:
+        if current_user['role'] == 'shop_owner':
+            shops = await db.shops.find({"owner_id": current_user['id']}, {"_id": 0, "id": 1}).to_list(None)
+            order_query = {"shop_id": {"$in": [shop['id'] for shop in shops]}}
+        elif current_user['role'] == 'delivery_agent':
+            order_query = {"delivery_agent_id": current_user['id']}
+        else:
+            order_query = {"customer_id": current_user['id']}
+        sources.append(SyncSource("orders", db.orders, order_query, ORDER_FIELDS))
+    
+    scope = sync_scope(current_user['id'] if current_user else None, shop_id)
+    return compressed_response(request, await sync_changes(sources, scope, token, limit))
 
 @api_router.get("/health")
 async def health_check():
-    return {"status": "ok", "service": "samaandena-api"}
+    return {
+        "status": "ok",
+        "service": "samaandena-api",
+        "user_cache": user_cache.stats(),
+        "password_pool": password_hasher.stats(),
+        "order_events": order_events.stats(),
+        "response_cache": response_cache.stats(),
+        "rate_limit": rate_limiter.stats(),
+        "jobs": job_queue.stats(),
+        "mongo_pool": {"max_pool_size": client.options.pool_options.max_pool_size, "servers": pool_tracker.stats()}
+    }
+
+@api_router.get("/ready")
+async def readiness_check(request: Request):
+    try:
+        await asyncio.wait_for(client.admin.command('ping'), READY_TIMEOUT)
+    except (PyMongoError, asyncio.TimeoutError) as e:
+        return ORJSONResponse(status_code=503, content={"status": "unavailable", "detail": type(e).__name__})
+    return {"status": "ready", "indexes": "ready" if request.app.state.indexes_ready else "building"}
 
-app.include_router(api_router)
+async def database_unavailable(request: Request, exc: ConnectionFailure):
+    # Pool wait, server selection and socket timeouts all land here
+    logger.warning("Database unavailable for %s %s: %s", request.method, request.url.path, exc)
+    return ORJSONResponse(
+        status_code=503, content={"detail": "Database unavailable, please retry"}, headers={"Retry-After": "1"}
+    )
 
-app.add_middleware(
-    CORSMiddleware,
-    allow_credentials=True,
-    allow_origins=os.environ.get('CORS_ORIGINS', '*').split(','),
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
+async def prometheus_metrics():
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
 
 logging.basicConfig(
     level=logging.INFO,
@@ -444,6 +1194,73 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-@app.on_event("shutdown")
-async def shutdown_db_client():
-    client.close()
\ No newline at end of file
+async def bootstrap_database(app: FastAPI):
+    # Runs beside request handling so workers serve as soon as they start.
+    # Once one worker has built the current index set, the others skip it.
+    try:
+        if await indexes_current(db):
+            app.state.indexes_ready = True
+            return
+        # Backfill GeoJSON points for shops and agents created before geo support
+        await db.shops.update_many(
+            {"geo": None, "location.lat": {"$type": "number"}, "location.lng": {"$type": "number"}},
+            [{"$set": {"geo": {"type": "Point", "coordinates": ["$location.lng", "$location.lat"]}}}]
+        )
+        await db.users.update_many(
+            {"role": "delivery_agent", "geo": None, "location.lat": {"$type": "number"}, "location.lng": {"$type": "number"}},
+            [{"$set": {"geo": {"type": "Point", "coordinates": ["$location.lng", "$location.lat"]}}}]
+        )
+        # Delta sync keys on updated_at, which shops and products did not always have
+        for collection in (db.shops, db.products):
+            await collection.update_many({"updated_at": None}, [{"$set": {"updated_at": "$created_at"}}])
+        built = await create_indexes(db)
+        app.state.indexes_ready = True
+        logger.info("Index bootstrap complete (%d new)", sum(len(names) for names in built.values()))
+    except PyMongoError:
+        logger.exception("Index bootstrap failed; run `python indexes.py` once the database is reachable")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    init_resources()
+    tasks = [asyncio.create_task(bootstrap_database(app)), asyncio.create_task(order_events.watch(db))]
+    archive_interval = float(os.environ.get('ORDER_ARCHIVE_INTERVAL', 3600))
+    if archive_interval > 0:
+        archive_after = timedelta(days=float(os.environ.get('ORDER_ARCHIVE_AFTER_DAYS', 30)))
+        tasks.append(asyncio.create_task(run_periodically(orders_db, archive_after, archive_interval)))
+    if os.environ.get('JOB_WORKER_EMBEDDED', 'true').lower() != 'false':
+        tasks.append(asyncio.create_task(job_queue.work(concurrency=int(os.environ.get('JOB_CONCURRENCY', 4)))))
+    try:
+        yield
+    finally:
+        for task in tasks:
+            task.cancel()
+        # Lets in-flight jobs finish before the client closes
+        await asyncio.gather(*tasks, return_exceptions=True)
+        close_resources()
+
+def create_app() -> FastAPI:
+    app = FastAPI(default_response_class=ORJSONResponse, lifespan=lifespan)
+    app.state.indexes_ready = False
+    app.add_exception_handler(ConnectionFailure, database_unavailable)
+    app.add_api_route("/metrics", prometheus_metrics, include_in_schema=False)
+    app.include_router(api_router)
+    if os.environ.get('RATE_LIMIT_ENABLED', 'true').lower() != 'false':
+        trust_proxy = os.environ.get('RATE_LIMIT_TRUST_PROXY', 'false').lower() == 'true'
+        app.add_middleware(
+            RateLimitMiddleware,
+            limiter=rate_limiter,
+            user_id=token_user_id,
+            proxy_hops=int(os.environ.get('RATE_LIMIT_PROXY_HOPS', 1)) if trust_proxy else 0
+        )
+    app.add_middleware(MetricsMiddleware, registry=metrics)
+    app.add_middleware(
+        CORSMiddleware,
+        allow_credentials=True,
+        allow_origins=os.environ.get('CORS_ORIGINS', '*').split(','),
+        allow_methods=["*"],
+        allow_headers=["*"],
+        expose_headers=[NEXT_CURSOR_HEADER, "Retry-After"],
+    )
+    return app
+
+app = create_app()
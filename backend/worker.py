@@ -0,0 +1,38 @@
+"""Run background jobs in their own process.
+
+Uses the same handlers and settings as the API. Start the API with
+JOB_WORKER_EMBEDDED=false when jobs should only run here:
+
+    python worker.py [--concurrency 4]
+"""
+import argparse
+import asyncio
+import logging
+import os
+import signal
+
+import server
+
+logger = logging.getLogger(__name__)
+
+
+async def main(concurrency: int) -> None:
+    server.init_resources()
+    worker = asyncio.create_task(server.job_queue.work(concurrency=concurrency))
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, worker.cancel)
+    logger.info("Job worker started (%d concurrent, handlers: %s)", concurrency, ", ".join(server.job_queue.handlers))
+    try:
+        await worker
+    except asyncio.CancelledError:
+        logger.info("Job worker stopped")
+    finally:
+        server.close_resources()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run SamaanDena background jobs")
+    parser.add_argument("--concurrency", type=int, default=int(os.environ.get('JOB_CONCURRENCY', 4)))
+    args = parser.parse_args()
+    asyncio.run(main(args.concurrency))
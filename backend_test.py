@@ -1,6 +1,7 @@
 import requests
 import sys
 import json
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 
 class SamaanDenaAPITester:
@@ -15,10 +16,11 @@ class SamaanDenaAPITester:
         self.tests_passed = 0
         self.failed_tests = []
 
-    def run_test(self, name, method, endpoint, expected_status, data=None, token=None, params=None):
-        """Run a single API test"""
+    def run_test(self, name, method, endpoint, expected_status, data=None, token=None, params=None,
+                 body=None, content_type='application/json'):
+        """Run a single API test; ``body`` sends raw text instead of JSON ``data``"""
         url = f"{self.base_url}/{endpoint}"
-        headers = {'Content-Type': 'application/json'}
+        headers = {'Content-Type': content_type}
         if token:
             headers['Authorization'] = f'Bearer {token}'
 
@@ -28,6 +30,8 @@ class SamaanDenaAPITester:
         try:
             if method == 'GET':
                 response = requests.get(url, headers=headers, params=params)
+            elif method == 'POST' and body is not None:
+                response = requests.post(url, data=body.encode(), headers=headers, params=params)
             elif method == 'POST':
                 response = requests.post(url, json=data, headers=headers, params=params)
             elif method == 'PUT':
@@ -60,6 +64,34 @@ class SamaanDenaAPITester:
             })
             return False, {}
 
+    def check(self, name, ok, detail=None):
+        """Record a check on a response body"""
+        self.tests_run += 1
+        if ok:
+            self.tests_passed += 1
+            print(f"   ✅ {name}")
+            return True
+        print(f"   ❌ {name}: {detail}")
+        self.failed_tests.append({'test': name, 'detail': detail})
+        return False
+
+    def register_extra_customer(self, label):
+        """Register a throwaway customer; returns ``{"user", "token"}`` or None"""
+        success, response = self.run_test(
+            f"Register {label} customer",
+            "POST",
+            "auth/register",
+            200,
+            data={
+                "email": f"test_{label}_{datetime.now():%Y%m%d%H%M%S%f}@example.com",
+                "password": "TestPass123!",
+                "name": f"Test {label.title()}",
+                "phone": "+1234567890",
+                "role": "customer"
+            }
+        )
+        return response if success and 'token' in response else None
+
     def test_root_endpoint(self):
         """Test root API endpoint"""
         success, response = self.run_test("Root API", "GET", "", 200)
@@ -264,6 +296,61 @@ class SamaanDenaAPITester:
         
         return success
 
+    def test_bulk_import(self):
+        """Test bulk product import as JSON, CSV and NDJSON, with per-row errors"""
+        if not self.shops:
+            print("❌ No shops available")
+            return False
+        
+        endpoint = f"products/bulk?shop_id={self.shops['test_shop']['id']}"
+        imports = [
+            ("JSON", 'application/json',
+             '[{"name": "Bulk Rice", "description": "Basmati", "price": 50, "category": "Groceries", "stock": 10},'
+             ' {"name": "Bulk Dal", "price": 80, "category": "Groceries", "stock": 5}]',
+             {"received": 2, "inserted": 2, "updated": 0, "failed": 0}, []),
+            # Updates Bulk Rice by name without a description column, so its description must survive
+            ("CSV", 'text/csv',
+             "name,price,category,stock\nBulk Rice,55,Groceries,12\nBulk Oil,120,Groceries,4\n",
+             {"received": 2, "inserted": 1, "updated": 1, "failed": 0}, []),
+            ("NDJSON", 'application/x-ndjson',
+             '{"name": "Bulk Salt", "price": 20, "category": "Groceries", "stock": 30}\n'
+             'not json\n'
+             '{"name": "Bulk Sugar", "price": -1, "category": "Groceries", "stock": 3}\n',
+             {"received": 3, "inserted": 1, "updated": 0, "failed": 2}, [2, 3]),
+        ]
+        for label, content_type, body, counts, error_rows in imports:
+            success, response = self.run_test(
+                f"Bulk Import {label}",
+                "POST",
+                endpoint,
+                200,
+                body=body,
+                content_type=content_type,
+                token=self.tokens['shop_owner']
+            )
+            if not success:
+                return False
+            summary = {key: response.get(key) for key in counts}
+            rows = [error['row'] for error in response.get('errors', [])]
+            if not self.check(f"{label} import summary", summary == counts and rows == error_rows, response):
+                return False
+        
+        success, response = self.run_test(
+            "Get Imported Products",
+            "GET",
+            "products",
+            200,
+            params={"shop_id": self.shops['test_shop']['id']}
+        )
+        if not success:
+            return False
+        rice = next((product for product in response if product['name'] == "Bulk Rice"), {})
+        return self.check(
+            "Re-imported row keeps unset columns",
+            rice.get('price') == 55 and rice.get('stock') == 12 and rice.get('description') == "Basmati",
+            rice
+        )
+
     def test_order_creation(self):
         """Test order creation by customer"""
         if not self.shops or not self.products:
@@ -302,6 +389,99 @@ class SamaanDenaAPITester:
         
         return success
 
+    def test_concurrent_checkout(self):
+        """Test that concurrent orders on a low-stock product never oversell"""
+        if not self.shops:
+            print("❌ No shops available")
+            return False
+        
+        # A fresh customer, so orders placed by earlier tests don't eat into
+        # the per-user checkout burst (10 by default)
+        stock, buyers = 3, 8
+        buyer = self.register_extra_customer("buyer")
+        if not buyer:
+            return False
+        
+        success, product = self.run_test(
+            "Create Low-Stock Product",
+            "POST",
+            f"products?shop_id={self.shops['test_shop']['id']}",
+            200,
+            data={"name": "Last Few", "description": "Hot item", "price": 10.0, "category": "Groceries", "stock": stock},
+            token=self.tokens['shop_owner']
+        )
+        if not success:
+            return False
+        
+        order_data = {
+            "shop_id": self.shops['test_shop']['id'],
+            "items": [{"product_id": product['id'], "quantity": 1}],
+            "delivery_address": "456 Customer Street, Test City",
+            "delivery_location": {"lat": 28.6139, "lng": 77.2090}
+        }
+        headers = {'Content-Type': 'application/json', 'Authorization': f"Bearer {buyer['token']}"}
+        
+        def place_order(_):
+            return requests.post(f"{self.base_url}/orders", json=order_data, headers=headers).status_code
+        
+        self.tests_run += 1
+        print(f"\n🔍 Testing {buyers} concurrent checkouts for {stock} items...")
+        with ThreadPoolExecutor(max_workers=buyers) as pool:
+            statuses = list(pool.map(place_order, range(buyers)))
+        
+        placed, rejected = statuses.count(200), statuses.count(409)
+        if placed == stock and rejected == buyers - stock:
+            self.tests_passed += 1
+            print(f"✅ Passed - {placed} placed, {rejected} rejected")
+            return True
+        
+        print(f"❌ Failed - Expected {stock} placed, got statuses {statuses}")
+        self.failed_tests.append({'test': "Concurrent Checkout", 'statuses': statuses})
+        return False
+
+    def test_batch_authorization(self):
+        """Test that batch lookups report another customer's order as missing"""
+        if not self.orders:
+            print("❌ No orders available")
+            return False
+        
+        order_id = self.orders['test_order']['id']
+        other = self.register_extra_customer("other")
+        if not other:
+            return False
+        
+        for label, token, visible in (("owner", self.tokens['customer'], True), ("other", other['token'], False)):
+            success, response = self.run_test(
+                f"Batch Orders as {label} customer",
+                "GET",
+                "orders/batch",
+                200,
+                token=token,
+                params={"ids": order_id}
+            )
+            if not success:
+                return False
+            expected = {"items": [order_id], "missing": []} if visible else {"items": [], "missing": [order_id]}
+            got = {"items": [order['id'] for order in response['items']], "missing": response['missing']}
+            if not self.check(f"Order batch as {label} customer", got == expected, response):
+                return False
+        
+        success, response = self.run_test(
+            "Combined Batch as other customer",
+            "POST",
+            "batch",
+            200,
+            data={"orders": [order_id], "shops": [self.shops['test_shop']['id']]},
+            token=other['token']
+        )
+        if not success:
+            return False
+        return self.check(
+            "Combined batch hides the order but not the shop",
+            response['orders'] == {"items": [], "missing": [order_id]} and len(response['shops']['items']) == 1,
+            response
+        )
+
     def test_get_orders(self):
         """Test getting orders for different user types"""
         for role in ['customer', 'shop_owner']:
@@ -415,6 +595,35 @@ class SamaanDenaAPITester:
         
         return success
 
+    def test_sync(self):
+        """Test getting a sync token and syncing again with it"""
+        success, response = self.run_test("Full Sync", "GET", "sync", 200, token=self.tokens['customer'])
+        if not success:
+            return False
+        if not self.check("Full sync resets and returns a token", response.get('reset') is True and response.get('token'), response):
+            return False
+        
+        success, response = self.run_test(
+            "Delta Sync",
+            "GET",
+            "sync",
+            200,
+            token=self.tokens['customer'],
+            params={"token": response['token']}
+        )
+        if not success:
+            return False
+        if not self.check("Delta sync reuses the token", response.get('reset') is False and response.get('token'), response):
+            return False
+        
+        # A token is scoped to its user, so another caller starts over
+        success, response = self.run_test("Sync with another user's token", "GET", "sync", 200, params={"token": response['token']})
+        if not success or not self.check("Foreign token resets", response.get('reset') is True, response):
+            return False
+        
+        success, _ = self.run_test("Sync with invalid token", "GET", "sync", 400, params={"token": "not-a-token"})
+        return success
+
 def main():
     print("🚀 Starting SamaanDena API Testing...")
     print("=" * 50)
@@ -433,13 +642,17 @@ def main():
         ("Product Creation", tester.test_product_creation),
         ("Get All Products", tester.test_get_products),
         ("Get Shop Products", tester.test_get_shop_products),
+        ("Bulk Import", tester.test_bulk_import),
         ("Order Creation", tester.test_order_creation),
+        ("Concurrent Checkout", tester.test_concurrent_checkout),
+        ("Batch Authorization", tester.test_batch_authorization),
         ("Get Orders", tester.test_get_orders),
         ("Get Delivery Agents", tester.test_get_delivery_agents),
         ("Assign Delivery Agent", tester.test_assign_delivery_agent),
         ("Update Order Status", tester.test_update_order_status),
         ("Create Review", tester.test_create_review),
-        ("Get Reviews", tester.test_get_reviews)
+        ("Get Reviews", tester.test_get_reviews),
+        ("Delta Sync", tester.test_sync)
     ]
     
     print(f"\n📋 Running {len(tests)} test categories...")